@@ -193,6 +193,14 @@ namespace Qiskit {
             RZ(targetQubit, MathHelper.Pi);
         }
 
+        public void S(int targetQubit) {
+            RZ(targetQubit, MathHelper.PiHalf);
+        }
+
+        public void T(int targetQubit) {
+            RZ(targetQubit, MathHelper.PiQuarter);
+        }
+
         public void Y(int targetQubit) {
             RZ(targetQubit, MathHelper.Pi);
             X(targetQubit);
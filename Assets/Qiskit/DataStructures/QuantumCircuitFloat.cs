@@ -208,6 +208,14 @@ namespace Qiskit.Float {
             RZ(targetQubit, MathHelper.PiFloat);
         }
 
+        public void S(int targetQubit) {
+            RZ(targetQubit, MathHelper.PiHalfFloat);
+        }
+
+        public void T(int targetQubit) {
+            RZ(targetQubit, MathHelper.PiQuarterFloat);
+        }
+
         public void Y(int targetQubit) {
             RZ(targetQubit, MathHelper.PiFloat);
             X(targetQubit);
@@ -153,13 +153,11 @@ namespace QuantumImage {
 
             MicroQiskitSimulator simulator = new MicroQiskitSimulator();
 
-            double[] doubleArray = new double[0];
-            string[] stringArray = new string[0];
+            Vector2Int dim = QuantumImageHelper.ParseVector(quantumCircuit.DimensionString);
 
-            QuantumImageHelper.GetProbabilityArrays(simulator.GetProbabilities(quantumCircuit), quantumCircuit.NumberOfQubits, ref doubleArray, ref stringArray);
-            IronPython.Runtime.PythonDictionary dictionary = pythonFile.HeightFromProbabilities(stringArray, doubleArray, doubleArray.Length, quantumCircuit.DimensionString, useLog);
+            dynamic heights = pythonFile.HeightArrayFromProbabilities(simulator.GetProbabilities(quantumCircuit), dim.x, dim.y, useLog);
 
-            return QuantumImageHelper.CalculateGreyTexture(dictionary, quantumCircuit.DimensionString);
+            return QuantumImageHelper.CalculateGreyTextureFromHeights(heights, dim.x, dim.y);
         }
 
 
@@ -175,20 +173,12 @@ namespace QuantumImage {
         public Texture2D GetColoreTexture(QuantumCircuit redCircuit, QuantumCircuit greenCircuit, QuantumCircuit blueCircuit, bool useLog = false) {
             MicroQiskitSimulator simulator = new MicroQiskitSimulator();
 
-            //TODO OPTIMIZATIOn initialize arrays only once
-            double[] doubleArray = new double[0];
-            string[] stringArray = new string[0];
+            Vector2Int dim = QuantumImageHelper.ParseVector(redCircuit.DimensionString);
 
-            QuantumImageHelper.GetProbabilityArrays(simulator.GetProbabilities(redCircuit), redCircuit.NumberOfQubits, ref doubleArray, ref stringArray);
-            IronPython.Runtime.PythonDictionary redDictionary = pythonFile.HeightFromProbabilities(stringArray, doubleArray, doubleArray.Length, redCircuit.DimensionString, useLog);
+            //All channels are decoded in a single python call
+            dynamic heights = pythonFile.ColorHeightArraysFromProbabilities(new double[][] { simulator.GetProbabilities(redCircuit), simulator.GetProbabilities(greenCircuit), simulator.GetProbabilities(blueCircuit) }, dim.x, dim.y, useLog);
 
-            QuantumImageHelper.GetProbabilityArrays(simulator.GetProbabilities(greenCircuit), greenCircuit.NumberOfQubits, ref doubleArray, ref stringArray);
-            IronPython.Runtime.PythonDictionary greenDictionary = pythonFile.HeightFromProbabilities(stringArray, doubleArray, doubleArray.Length, greenCircuit.DimensionString, useLog);
-
-            QuantumImageHelper.GetProbabilityArrays(simulator.GetProbabilities(blueCircuit), blueCircuit.NumberOfQubits, ref doubleArray, ref stringArray);
-            IronPython.Runtime.PythonDictionary blueDictionary = pythonFile.HeightFromProbabilities(stringArray, doubleArray, doubleArray.Length, blueCircuit.DimensionString, useLog);
-
-            return QuantumImageHelper.CalculateColorTexture(redDictionary, greenDictionary, blueDictionary, redCircuit.DimensionString);
+            return QuantumImageHelper.CalculateColorTextureFromHeights(heights[0], heights[1], heights[2], dim.x, dim.y);
         }
 
         /// <summary>
@@ -209,19 +199,18 @@ namespace QuantumImage {
             double[] probabilities = new double[MathHelper.IntegerPower(2, redCircuit.NumberOfQubits)];
             ComplexNumber[] amplitudes = null;
 
-            string[] stringArray = QuantumImageHelper.CalculateNameStrings(probabilities.Length, redCircuit.NumberOfQubits);
+            double[] greenProbabilities = new double[probabilities.Length];
+            double[] blueProbabilities = new double[probabilities.Length];
 
             simulator.CalculateProbabilities(redCircuit, ref probabilities, ref amplitudes);
+            simulator.CalculateProbabilities(greenCircuit, ref greenProbabilities, ref amplitudes);
+            simulator.CalculateProbabilities(blueCircuit, ref blueProbabilities, ref amplitudes);
 
-            IronPython.Runtime.PythonDictionary redDictionary = pythonFile.HeightFromProbabilities(stringArray, probabilities, probabilities.Length, redCircuit.DimensionString, useLog);
-
-            simulator.CalculateProbabilities(greenCircuit, ref probabilities, ref amplitudes);
-            IronPython.Runtime.PythonDictionary greenDictionary = pythonFile.HeightFromProbabilities(stringArray, probabilities, probabilities.Length, greenCircuit.DimensionString, useLog);
-
-            simulator.CalculateProbabilities(blueCircuit, ref probabilities, ref amplitudes);
-            IronPython.Runtime.PythonDictionary blueDictionary = pythonFile.HeightFromProbabilities(stringArray, probabilities, probabilities.Length, blueCircuit.DimensionString, useLog);
+            //All channels are decoded in a single python call, and the probabilities are passed as they are, so no names have to be made or parsed
+            Vector2Int dim = QuantumImageHelper.ParseVector(redCircuit.DimensionString);
+            dynamic heights = pythonFile.ColorHeightArraysFromProbabilities(new double[][] { probabilities, greenProbabilities, blueProbabilities }, dim.x, dim.y, useLog);
 
-            return QuantumImageHelper.CalculateColorTexture(redDictionary, greenDictionary, blueDictionary, redCircuit.DimensionString);
+            return QuantumImageHelper.CalculateColorTextureFromHeights(heights[0], heights[1], heights[2], dim.x, dim.y);
         }
 
         /// <summary>
@@ -304,8 +293,9 @@ namespace QuantumImage {
             double[,] imageData = QuantumImageHelper.GetGreyHeighArray(inputTexture);
             double[,] imageData2 = QuantumImageHelper.GetGreyHeighArray(inputTexture2);
 
-            IronPython.Runtime.PythonDictionary greyDictionary = getTeleportDictionaryFromData(out heightDimensions, imageData, imageData2, teleportationProgress);
-            OutputTexture = QuantumImageHelper.CalculateGreyTexture(greyDictionary, heightDimensions);
+            dynamic greyHeights = getTeleportHeightsFromData(out heightDimensions, imageData, imageData2, teleportationProgress);
+            Vector2Int dim = QuantumImageHelper.ParseVector(heightDimensions);
+            OutputTexture = QuantumImageHelper.CalculateGreyTextureFromHeights(greyHeights, dim.x, dim.y);
 
             return OutputTexture;
         }
@@ -368,16 +358,16 @@ namespace QuantumImage {
 
             string heightDimensions;
 
-            IronPython.Runtime.PythonDictionary greyDictionary;
+            dynamic greyHeights;
 
             for (int i = 0; i < totalX; i++) {
                 for (int j = 0; j < totalY; j++) {
                     double max1 = QuantumImageHelper.FillPartialHeightArray(inputTexture, imageData, ColorChannel.R, startX, startY, dimX, dimY);
                     double max2 = QuantumImageHelper.FillPartialHeightArray(inputTexture2, imageData2, ColorChannel.R, startX, startY, dimX, dimY);
 
-                    greyDictionary = getTeleportDictionaryFromData(out heightDimensions, imageData, imageData2, mixture, (1 - mixture) * max1 + mixture * max2);
+                    greyHeights = getTeleportHeightsFromData(out heightDimensions, imageData, imageData2, mixture, (1 - mixture) * max1 + mixture * max2);
 
-                    QuantumImageHelper.FillTextureGrey(greyDictionary, OutputTexture, startX, startY);
+                    QuantumImageHelper.FillTextureGreyFromHeights(greyHeights, OutputTexture, dimX, dimY, startX, startY);
 
                     startY += dimY;
                     startY = startY % width;
@@ -452,27 +442,27 @@ namespace QuantumImage {
 
             string heightDimensions;
 
-            IronPython.Runtime.PythonDictionary redDictionary, greenDictionary, blueDictionary;
+            dynamic redHeights, greenHeights, blueHeights;
 
             for (int i = 0; i < totalX; i++) {
                 for (int j = 0; j < totalY; j++) {
                     double max1 = QuantumImageHelper.FillPartialHeightArray(inputTexture, redImageData, ColorChannel.R, startX, startY, dimX, dimY);
                     double max2 = QuantumImageHelper.FillPartialHeightArray(inputTexture2, redImageData2, ColorChannel.R, startX, startY, dimX, dimY);
 
-                    redDictionary = getTeleportDictionaryFromData(out heightDimensions, redImageData, redImageData2, mixture, (1 - mixture) * max1 + mixture * max2);
+                    redHeights = getTeleportHeightsFromData(out heightDimensions, redImageData, redImageData2, mixture, (1 - mixture) * max1 + mixture * max2);
 
                     max1 = QuantumImageHelper.FillPartialHeightArray(inputTexture, greenImageData, ColorChannel.G, startX, startY, dimX, dimY);
                     max2 = QuantumImageHelper.FillPartialHeightArray(inputTexture2, greenImageData2, ColorChannel.G, startX, startY, dimX, dimY);
 
-                    greenDictionary = getTeleportDictionaryFromData(out heightDimensions, greenImageData, greenImageData2, mixture, (1 - mixture) * max1 + mixture * max2);
+                    greenHeights = getTeleportHeightsFromData(out heightDimensions, greenImageData, greenImageData2, mixture, (1 - mixture) * max1 + mixture * max2);
 
                     max1 = QuantumImageHelper.FillPartialHeightArray(inputTexture, blueImageData, ColorChannel.B, startX, startY, dimX, dimY);
                     max2 = QuantumImageHelper.FillPartialHeightArray(inputTexture2, blueImageData2, ColorChannel.B, startX, startY, dimX, dimY);
 
-                    blueDictionary = getTeleportDictionaryFromData(out heightDimensions, blueImageData, blueImageData2, mixture, (1 - mixture) * max1 + mixture * max2);
+                    blueHeights = getTeleportHeightsFromData(out heightDimensions, blueImageData, blueImageData2, mixture, (1 - mixture) * max1 + mixture * max2);
 
 
-                    QuantumImageHelper.FillTextureColored(redDictionary, greenDictionary, blueDictionary, OutputTexture, startX, startY);
+                    QuantumImageHelper.FillTextureColoredFromHeights(redHeights, greenHeights, blueHeights, OutputTexture, dimX, dimY, startX, startY);
 
                     startY += dimY;
                     startY = startY % width;
@@ -676,18 +666,10 @@ namespace QuantumImage {
             blurHelper.ApplyPartialX(rotation);
 
             dynamic circuit = blurHelper.GetCircuit();
-            int numberofQubits = circuit.num_qubits;
             heightDimensions = circuit.name;
 
-
-            QuantumCircuit quantumCircuit = QuantumImageHelper.ParseCircuit(circuit.data, numberofQubits);
-            MicroQiskitSimulator simulator = new MicroQiskitSimulator();
-
-            double[] doubleArray = new double[0];
-            string[] stringArray = new string[0];
-
-            QuantumImageHelper.GetProbabilityArrays(simulator.GetProbabilities(quantumCircuit), numberofQubits, ref doubleArray, ref stringArray);
-            IronPython.Runtime.PythonDictionary dictionary = pythonFile.HeightFromProbabilities(stringArray, doubleArray, doubleArray.Length, heightDimensions, useLog);
+            //The helper keeps the encoded image, so the blur is calculated from it directly instead of simulating the circuit
+            IronPython.Runtime.PythonDictionary dictionary = blurHelper.GetHeights();
 
             return dictionary;
         }
@@ -711,7 +693,7 @@ namespace QuantumImage {
             return quantumCircuit;
         }
 
-        IronPython.Runtime.PythonDictionary getTeleportDictionaryFromData(out string heightDimensions, double[,] imageData, double[,] imageData2, double mixture, double normalization = 0, bool useLog = false) {
+        dynamic getTeleportHeightsFromData(out string heightDimensions, double[,] imageData, double[,] imageData2, double mixture, double normalization = 0, bool useLog = false) {
             dynamic teleportationHelper = pythonFile.TeleportationHelper("TeleportationHelper");
 
             bool normalizeManually = normalization > 0;
@@ -729,16 +711,10 @@ namespace QuantumImage {
 
             quantumCircuit.Normalize();
 
-            double[] doubleArray = new double[0];
-            string[] stringArray = new string[0];
-
             double[] probs = simulator.GetProbabilities(quantumCircuit);
 
-
-            QuantumImageHelper.GetProbabilityArrays(probs, numberofQubits, ref doubleArray, ref stringArray);
-
-            IronPython.Runtime.PythonDictionary dictionary = pythonFile.CombinedHeightFromProbabilities(stringArray, doubleArray, doubleArray.Length, numberofQubits, heightDimensions, useLog, normalization);
-            return dictionary;
+            Vector2Int dim = QuantumImageHelper.ParseVector(heightDimensions);
+            return pythonFile.CombinedHeightArrayFromProbabilities(probs, numberofQubits, dim.x, dim.y, useLog, normalization);
         }
 #endif
 
@@ -717,6 +717,30 @@ namespace QuantumImage {
                     case "crx":
                         circuit.CRX((int)third, (int)forth, (double)second);
                         break;
+                    case "rz":
+                        circuit.RZ((int)third, (double)second);
+                        break;
+                    case "ry":
+                        circuit.RY((int)third, (double)second);
+                        break;
+                    case "z":
+                        circuit.Z((int)second);
+                        break;
+                    case "s":
+                        circuit.S((int)second);
+                        break;
+                    case "t":
+                        circuit.T((int)second);
+                        break;
+                    case "y":
+                        circuit.Y((int)second);
+                        break;
+                    case "pswap":
+                        // partial swap, applied with the same decomposition as in quantumblur.partialswap
+                        circuit.CX((int)forth, (int)third);
+                        circuit.CRX((int)third, (int)forth, Math.PI * Convert.ToDouble(second));
+                        circuit.CX((int)forth, (int)third);
+                        break;
 
                     default:
                         Debug.Log("Not recognized");
@@ -833,6 +857,53 @@ namespace QuantumImage {
             texture.Apply();
             return texture;
         }
+
+        //The following take the flat height buffers returned by the python helper (the height for (x,y) is at y*width+x),
+        //which is also the order used by Texture2D.SetPixels, so no coordinate strings have to be parsed
+
+        public static Texture2D CalculateGreyTextureFromHeights(dynamic heights, int width, int height) {
+            Texture2D texture = new Texture2D(width, height);
+            texture.SetPixels(GreyColorsFromHeights(heights, width * height));
+            texture.Apply();
+            return texture;
+        }
+
+        public static void FillTextureGreyFromHeights(dynamic heights, Texture2D textureToFill, int width, int height, int startWidth = 0, int startHeight = 0) {
+            textureToFill.SetPixels(startWidth, startHeight, width, height, GreyColorsFromHeights(heights, width * height));
+        }
+
+        public static Texture2D CalculateColorTextureFromHeights(dynamic redHeights, dynamic greenHeights, dynamic blueHeights, int width, int height) {
+            Texture2D texture = new Texture2D(width, height);
+            texture.SetPixels(ColorsFromHeights(redHeights, greenHeights, blueHeights, width * height));
+            texture.Apply();
+            return texture;
+        }
+
+        public static void FillTextureColoredFromHeights(dynamic redHeights, dynamic greenHeights, dynamic blueHeights, Texture2D textureToFill, int width, int height, int startWidth = 0, int startHeight = 0) {
+            textureToFill.SetPixels(startWidth, startHeight, width, height, ColorsFromHeights(redHeights, greenHeights, blueHeights, width * height));
+        }
+
+        static Color[] GreyColorsFromHeights(dynamic heights, int length) {
+            Color[] colors = new Color[length];
+            float greyValue;
+
+            for (int i = 0; i < length; i++) {
+                greyValue = (float)(double)heights[i];
+                colors[i] = new Color(greyValue, greyValue, greyValue);
+            }
+
+            return colors;
+        }
+
+        static Color[] ColorsFromHeights(dynamic redHeights, dynamic greenHeights, dynamic blueHeights, int length) {
+            Color[] colors = new Color[length];
+
+            for (int i = 0; i < length; i++) {
+                colors[i] = new Color((float)(double)redHeights[i], (float)(double)greenHeights[i], (float)(double)blueHeights[i]);
+            }
+
+            return colors;
+        }
 #endif
 
         public static Texture2D CalculateColorTexture(double[,] redData, double[,] greenData, double[,] blueData, float redScale = 1, float greenScale = 1, float blueScale = 1) {
@@ -1048,23 +1119,6 @@ namespace QuantumImage {
 
         }
 
-        public static string[] CalculateNameStrings(int numberOfProbabilities, int numberOfQubits) {
-            string[] generatedNames = new string[numberOfProbabilities];
-
-            string[] prefixes = CalculatePrefixStrings(numberOfQubits);
-
-            string binary = "";//= Convert.ToString(value, 2);
-
-
-            for (int i = 0; i < numberOfProbabilities; i++) {
-
-                binary = Convert.ToString(i, 2);
-                binary = prefixes[binary.Length] + binary;
-                generatedNames[i] = binary;
-            }
-
-            return generatedNames;
-        }
 
 
 
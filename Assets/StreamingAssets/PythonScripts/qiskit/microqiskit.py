@@ -2,10 +2,32 @@
 # It has many more features, and access to real quantum computers.
 
 import random
+import sys
+import hashlib
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
 from math import cos,sin,pi
+from array import array
+try:
+  import queue
+except ImportError:
+  import Queue as queue
+
+# NumPy is used to speed up simulation when it is available, but it is not required.
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+# The NumPy random generators, which can be used for sampling instead of those of the `random` module.
+_numpy_generators = () if np is None else tuple(getattr(np.random,name) for name in ['RandomState','Generator'] if hasattr(np.random,name))
 
 r2=0.70710678118 # 1/sqrt(2) will come in handy
 
+# The single qubit gates recognized by the simulator. Of these, 'u' is used only for gates created by `optimize`.
+single_qubit_gates = ['x','h','rx','rz','ry','z','y','s','t','u']
+
 class QuantumCircuit:
   
   def __init__(self,n,m=0):
@@ -29,7 +51,10 @@ class QuantumCircuit:
   def initialize(self,k):
     '''Initializes the qubits in a given state.'''
     self.data[:] = [] # Clear existing gates.
-    self.data.append(('init',[e for e in k])) # Add the instruction to initialize, including the required state.
+    if isinstance(k,ProductState): # Product states are kept as they are, so that they are only expanded if required.
+      self.data.append(('init',k))
+    else:
+      self.data.append(('init',[e for e in k])) # Add the instruction to initialize, including the required state.
   
   def x(self,q):
     '''Applies an x gate to the given qubit.'''
@@ -59,32 +84,255 @@ class QuantumCircuit:
   
   def rz(self,theta,q):
     '''Applies an rz gate to the given qubit by the given angle.'''
-    # This gate is constructed from `h` and `rx`.
-    self.h(q)
-    self.rx(theta,q)
-    self.h(q)
+    self.data.append(('rz',theta,q))
   
   def ry(self,theta,q):
     '''Applies an ry gate to the given qubit by the given angle.'''
-    # This gate is constructed from `rx` and `rz`.
-    self.rx(pi/2,q)
-    self.rz(theta,q)
-    self.rx(-pi/2,q)
+    self.data.append(('ry',theta,q))
   
   def z(self,q):
-    # This gate is constructed from `rz`.
     '''Applies a z gate to the given qubit.'''
-    self.rz(pi,q)
+    # This gate is rz(pi), which differs from the usual z only by a global phase.
+    self.data.append(('z',q))
   
   def y(self,q):
     '''Applies an y gate to the given qubit.'''
-    # This gate is constructed from `rz` and `x`.
-    self.rz(pi,q)
-    self.x(q)
+    # This gate is rz(pi) followed by x, which differs from the usual y only by a global phase.
+    self.data.append(('y',q))
+  
+  def s(self,q):
+    '''Applies an s gate to the given qubit.'''
+    self.data.append(('s',q))
+  
+  def t(self,q):
+    '''Applies a t gate to the given qubit.'''
+    self.data.append(('t',q))
+  
+  def pswap(self,fraction,q0,q1):
+    '''Applies the given fraction of a swap gate to the given qubits.'''
+    # This is the same as cx(q1,q0), crx(pi*fraction,q0,q1) and cx(q1,q0), applied as a single gate.
+    self.data.append(('pswap',fraction,q0,q1))
 
 
-def simulate(qc,shots=1024,get='counts'):
-  '''Simulates the given circuit `qc`, and outputs the results in the form specified by `shots` and `get`.'''
+class Parameter:
+  '''A symbolic angle, whose value can be given after a circuit has been compiled using `compile`.
+  Parameters can be multiplied and divided by numbers, and have numbers added to them, as in `pi*fraction`.'''
+  
+  def __init__(self,name,scale=1.0,offset=0.0):
+    '''The value of the parameter will be `scale` times the value given for `name`, plus `offset`.'''
+    self.name = name
+    self.scale = scale
+    self.offset = offset
+  
+  def __mul__(self,k):
+    return Parameter(self.name,self.scale*k,self.offset*k)
+  
+  __rmul__ = __mul__
+  
+  def __truediv__(self,k):
+    return self*(1.0/k)
+  
+  __div__ = __truediv__
+  
+  def __add__(self,k):
+    return Parameter(self.name,self.scale,self.offset+k)
+  
+  __radd__ = __add__
+  
+  def __sub__(self,k):
+    return self+(-k)
+  
+  def __neg__(self):
+    return self*-1
+  
+  def __float__(self):
+    raise TypeError('No value has been given for parameter '+str(self.name)+'.')
+  
+  def __repr__(self):
+    return 'Parameter('+repr(self.name)+','+repr(self.scale)+','+repr(self.offset)+')'
+  
+  def bind(self,values):
+    '''Returns the value of the parameter, for the given dictionary of parameter names and values.'''
+    assert self.name in values, 'No value has been given for parameter '+str(self.name)+'.'
+    return self.scale*values[self.name]+self.offset
+
+
+class ProductState:
+  '''A statevector that is the tensor product of the given statevectors, with the first on the highest qubits (as for the Kronecker product).
+  The full statevector is only calculated when required. Its elements can be accessed as for a list, but `expand` is much faster for getting all of them.'''
+  
+  def __init__(self,*factors):
+    self.factors = []
+    for k in factors:
+      if type(k[0])==list: # Complex numbers given as a list of two real numbers are converted.
+        k = [complex(e[0],e[1]) for e in k]
+      self.factors.append(k)
+  
+  def __len__(self):
+    size = 1
+    for k in self.factors:
+      size *= len(k)
+    return size
+  
+  def __getitem__(self,j):
+    if j<0:
+      j += len(self)
+    if not 0<=j<len(self):
+      raise IndexError('ProductState index out of range')
+    amp = 1
+    for k in reversed(self.factors):
+      j,r = divmod(j,len(k))
+      amp = k[r]*amp
+    return amp
+  
+  def __iter__(self):
+    return iter(self.expand())
+  
+  def num_qubits(self):
+    '''Returns the number of qubits for each factor.'''
+    return [len(k).bit_length()-1 for k in self.factors]
+  
+  def expand(self):
+    '''Returns the full statevector as a list.'''
+    k = [1]
+    for factor in self.factors:
+      k = [amp0*amp1 for amp0 in k for amp1 in factor]
+    return k
+  
+  def _expand_numpy(self):
+    '''Returns the full statevector as a NumPy array of complex numbers.'''
+    k = np.ones(1,dtype=complex)
+    for factor in self.factors:
+      k = np.outer(k,np.asarray(factor,dtype=complex)).reshape(-1)
+    return k
+
+
+def _single_qubit_matrix(gate):
+  '''Returns the matrix for the given single qubit gate, as a pair of rows of complex numbers.'''
+  if gate[0] in ['rx','rz','ry']:
+    theta = float(gate[1])
+    c,s = cos(theta/2),sin(theta/2)
+  if gate[0]=='u': # The matrix is given explicitly.
+    return gate[1]
+  elif gate[0]=='x':
+    return ((0j,1+0j),(1+0j,0j))
+  elif gate[0]=='h':
+    return ((r2+0j,r2+0j),(r2+0j,-r2+0j))
+  elif gate[0]=='rx':
+    return ((complex(c,0),complex(0,-s)),(complex(0,-s),complex(c,0)))
+  elif gate[0]=='rz':
+    return ((complex(c,-s),0j),(0j,complex(c,s)))
+  elif gate[0]=='ry':
+    return ((complex(c,0),complex(-s,0)),(complex(s,0),complex(c,0)))
+  elif gate[0]=='z':
+    return ((-1j,0j),(0j,1j))
+  elif gate[0]=='y':
+    return ((0j,1j),(-1j,0j))
+  elif gate[0]=='s':
+    return ((1+0j,0j),(0j,1j))
+  elif gate[0]=='t':
+    return ((1+0j,0j),(0j,complex(cos(pi/4),sin(pi/4))))
+
+
+def _is_identity(u,tol=1e-10):
+  '''Determines whether the given single qubit matrix is the identity (up to the given tolerance).'''
+  return abs(u[0][0]-1)<tol and abs(u[1][1]-1)<tol and abs(u[0][1])<tol and abs(u[1][0])<tol
+
+
+def optimize(qc):
+  '''Returns a circuit that is equivalent to `qc`, but with fewer gates.
+  Consecutive single qubit gates on the same qubit are merged, either into a single `rx` (if they are all `rx`) or into a 'u' gate that holds their combined matrix, and are removed entirely if they combine to the identity.
+  Pairs of identical `cx` gates with nothing in between on either qubit cancel, and consecutive `crx` (or `pswap`) gates on the same qubits have their angles (or fractions) combined.'''
+  
+  # Single qubit gates waiting to be merged, for each qubit.
+  pending = [[] for _ in range(qc.num_qubits)]
+  # For each qubit, the positions in `data` of the gates that act on it.
+  touched = [[] for _ in range(qc.num_qubits)]
+  data = []
+  
+  def flush(q):
+    '''Merges the pending single qubit gates for qubit `q`, and adds the result to `data`.'''
+    gates = pending[q]
+    pending[q] = []
+    if not gates:
+      return
+    if len(gates)==1:
+      gate = gates[0]
+    elif all([g[0]=='rx' for g in gates]):
+      gate = ('rx',sum([float(g[1]) for g in gates]),q)
+    else:
+      u = ((1+0j,0j),(0j,1+0j))
+      for g in gates:
+        (a,b),(c,d) = _single_qubit_matrix(g)
+        u = ((a*u[0][0]+b*u[1][0],a*u[0][1]+b*u[1][1]),(c*u[0][0]+d*u[1][0],c*u[0][1]+d*u[1][1]))
+      gate = ('u',u,q)
+    if not _is_identity(_single_qubit_matrix(gate)):
+      touched[q].append(len(data))
+      data.append(gate)
+  
+  for gate in qc.data:
+    
+    if gate[0]=='init': # Everything before an initialization is overwritten, so only the measure commands need to be kept.
+      data = [g for g in data if g is not None and g[0]=='m']+[gate]
+      pending = [[] for _ in range(qc.num_qubits)]
+      touched = [[] for _ in range(qc.num_qubits)]
+    
+    elif gate[0]=='m':
+      data.append(gate)
+    
+    elif gate[0] in single_qubit_gates:
+      if _is_parameterized(gate): # Gates with parameters are kept as they are.
+        flush(gate[-1])
+        touched[gate[-1]].append(len(data))
+        data.append(gate)
+      else:
+        pending[gate[-1]].append(gate)
+    
+    elif gate[0] in ['cx','crx','pswap']:
+      [s,t] = gate[-2:]
+      if gate[0]!='cx' and not _is_parameterized(gate):
+        # The pswap gate acts as an rx by pi*fraction on the states for which the qubits differ.
+        angle = pi*float(gate[1]) if gate[0]=='pswap' else float(gate[1])
+        if _is_identity(_single_qubit_matrix(('rx',angle,t))): # Gates that do nothing are removed.
+          continue
+      flush(s)
+      flush(t)
+      # Check whether the last gate on both qubits was the same one, and whether it can be combined with this.
+      if touched[s] and touched[t] and touched[s][-1]==touched[t][-1]:
+        j = touched[s][-1]
+        last = data[j]
+        if last[0]==gate[0] and last[-2:]==gate[-2:] and not (_is_parameterized(last) or _is_parameterized(gate)):
+          if gate[0]!='cx':
+            theta = float(last[1])+float(gate[1])
+            angle = pi*theta if gate[0]=='pswap' else theta
+          if gate[0]=='cx' or _is_identity(_single_qubit_matrix(('rx',angle,t))):
+            data[j] = None
+            touched[s].pop()
+            touched[t].pop()
+          else:
+            data[j] = (gate[0],theta,s,t)
+          continue
+      touched[s].append(len(data))
+      touched[t].append(len(data))
+      data.append(gate)
+    
+    else: # Anything else acts as a barrier for all qubits.
+      for q in range(qc.num_qubits):
+        flush(q)
+        touched[q].append(len(data))
+      data.append(gate)
+  
+  for q in range(qc.num_qubits):
+    flush(q)
+  
+  optimized_qc = QuantumCircuit(qc.num_qubits,qc.num_clbits)
+  optimized_qc.name = qc.name
+  optimized_qc.data = [gate for gate in data if gate is not None]
+  return optimized_qc
+
+
+def _evolve_lists(qc):
+  '''Applies the gates of `qc` to a statevector stored as a list of [real,imaginary] pairs, and returns the real and imaginary parts as two lists.'''
   
   def superpose(x,y):
     '''For two elements of the statevector, x and y, return (x+y)/sqrt(2) and (x-y)/sqrt(2)'''
@@ -95,29 +343,33 @@ def simulate(qc,shots=1024,get='counts'):
     theta = float(theta)
     return [x[0]*cos(theta/2)+y[1]*sin(theta/2),x[1]*cos(theta/2)-y[0]*sin(theta/2)],[y[0]*cos(theta/2)+x[1]*sin(theta/2),y[1]*cos(theta/2)-x[0]*sin(theta/2)]
   
+  def apply(x,y,u):
+    '''For two elements of the statevector, x and y, return u[0][0]*x + u[0][1]*y and u[1][0]*x + u[1][1]*y'''
+    x,y = complex(x[0],x[1]),complex(y[0],y[1])
+    x,y = u[0][0]*x+u[0][1]*y,u[1][0]*x+u[1][1]*y
+    return [x.real,x.imag],[y.real,y.imag]
+  
   # Initialize a 2^n element statevector. Complex numbers are expressed as a list of two real numbers.
   k = [[0,0] for _ in range(2**qc.num_qubits)] # First with zeros everywhere.
   k[0] = [1.0,0.0] # Then a single 1 to create the all |0> state.
 
-  # The `outputnum_clbitsap` dictionary keeps track of which qubits are read out to which output bits
-  outputnum_clbitsap = {}
-
   # Now we go through the gates and apply them to the statevector.
   # Each gate is specified by a tuple, as defined in the QuantumCircuit class
   for gate in qc.data:
     
     if gate[0]=='init': # For initializion, copy in the given statevector.
-      if type(gate[1][0])==list:
+      if isinstance(gate[1],ProductState):
+        k = [[complex(e).real,complex(e).imag] for e in gate[1].expand()]
+      elif type(gate[1][0])==list:
         k = [e for e in gate[1]]
       else: # This allows for simple lists of real numbers to be accepted as input.
         k = [[e,0] for e in gate[1]]
-        
-    elif gate[0]=='m': # For measurement, keep a record of which bit goes with which qubit.
-      outputnum_clbitsap[gate[2]] = gate[1]
     
-    elif gate[0] in ['x','h','rx']: # These are the only single qubit gates recognized by the simulator.
+    elif gate[0] in single_qubit_gates:
       
       j = gate[-1] # The qubit on which these gates act is the final element of the tuple.
+      if gate[0] not in ['x','h','rx']:
+        u = _single_qubit_matrix(gate)
   
       # These gates affect elements of the statevector in pairs.
       # These pairs are the elements whose corresponding bit strings differ only on bit `j`.
@@ -130,9 +382,11 @@ def simulate(qc,shots=1024,get='counts'):
             k[b0],k[b1]=k[b1],k[b0]
           elif gate[0]=='h': # For x, superpose them
             k[b0],k[b1]=superpose(k[b0],k[b1])
-          else: # For rx, construct the superposition required for the given angle
+          elif gate[0]=='rx': # For rx, construct the superposition required for the given angle
             theta = gate[1]
             k[b0],k[b1]=turn(k[b0],k[b1],theta)
+          else: # For the others, apply the matrix for the gate
+            k[b0],k[b1]=apply(k[b0],k[b1],u)
     
     elif gate[0] in ['cx','crx']: # These are the only two qubit gates recognized by the simulator.
       
@@ -159,21 +413,735 @@ def simulate(qc,shots=1024,get='counts'):
                 k[b0],k[b1]=k[b1],k[b0] # Flip the values.
             else:
                 k[b0],k[b1]=turn(k[b0],k[b1],theta) # Perform the rotation.
+    
+    elif gate[0]=='pswap':
+      
+      theta = pi*float(gate[1])
+      [s,t] = gate[2:]
+      [l,h] = sorted([s,t])
+      
+      # This gate acts as an rx on pairs of elements whose corresponding bit strings differ on both bits, with a '1' on bit 's' for the first of the pair and on bit 't' for the second.
+      for i0 in range(2**l):
+        for i1 in range(2**(h-l-1)):
+          for i2 in range(2**(qc.num_qubits-h-1)):
+            b0=i0+2**(l+1)*i1+2**(h+1)*i2+2**s # Index corresponding to bit string for which digit `s` is `1` and digit `t` is '0'.
+            b1=b0-2**s+2**t # Index corresponding to the same bit string except with these two digits reversed.
+            k[b0],k[b1]=turn(k[b0],k[b1],theta)
+  
+  return [e[0] for e in k],[e[1] for e in k]
+
+
+# The kernels below apply a single gate to the statevector `state`.
+# For the 'array' engine, the state is a pair of `array('d')` buffers holding the real and imaginary parts, which are updated in place.
+# No new objects are created per amplitude, and the arithmetic is done in the same order as in `_evolve_lists`, so the results are identical.
+# The argument `where` holds the index strides required, as calculated by `CompiledCircuit`, and `numbers` holds any values that depend on the angle.
+# The kernels can also be applied only to the elements from `start` to `stop`, as long as no pair of elements crosses these limits.
+
+def _array_init(state,where,numbers):
+  '''Replaces the state with a copy of the initial state in `numbers`.'''
+  return array('d',numbers[0]),array('d',numbers[1])
+
+def _array_x(state,step,numbers,start=0,stop=None):
+  '''Applies an x to the qubit for which pairs of elements differ by `step`.'''
+  re,im = state
+  # Each block of 2*step elements contains `step` pairs, so the two halves of each block are swapped.
+  for b0 in range(start,stop or len(re),2*step):
+    b1,b2 = b0+step,b0+2*step
+    re[b0:b1],re[b1:b2] = re[b1:b2],re[b0:b1]
+    im[b0:b1],im[b1:b2] = im[b1:b2],im[b0:b1]
+  return state
+
+def _array_h(state,step,numbers,start=0,stop=None):
+  '''Applies an h to the qubit for which pairs of elements differ by `step`.'''
+  re,im = state
+  for b in range(start,stop or len(re),2*step):
+    for b0 in range(b,b+step):
+      b1 = b0+step
+      x0,y0 = re[b0],re[b1]
+      re[b0],re[b1] = r2*(x0+y0),r2*(x0-y0)
+      x0,y0 = im[b0],im[b1]
+      im[b0],im[b1] = r2*(x0+y0),r2*(x0-y0)
+  return state
+
+def _array_rx(state,step,numbers,start=0,stop=None):
+  '''Applies an rx to the qubit for which pairs of elements differ by `step`, where `numbers` holds the cosine and sine of half the angle.'''
+  re,im = state
+  c,s = numbers
+  for b in range(start,stop or len(re),2*step):
+    for b0 in range(b,b+step):
+      b1 = b0+step
+      x0,x1,y0,y1 = re[b0],im[b0],re[b1],im[b1]
+      re[b0],im[b0] = x0*c+y1*s,x1*c-y0*s
+      re[b1],im[b1] = y0*c+x1*s,y1*c-x0*s
+  return state
+
+def _array_diag(state,step,numbers,start=0,stop=None):
+  '''Applies a diagonal gate (such as rz, z, s and t) with matrix `numbers` to the qubit for which pairs of elements differ by `step`.'''
+  re,im = state
+  (u00,_),(_,u11) = numbers
+  # Each element is simply multiplied by a phase.
+  for offset,u in [(0,u00),(step,u11)]:
+    if u!=1:
+      c,s = u.real,u.imag
+      for b in range(start+offset,stop or len(re),2*step):
+        for b0 in range(b,b+step):
+          x0,x1 = re[b0],im[b0]
+          re[b0],im[b0] = x0*c-x1*s,x0*s+x1*c
+  return state
+
+def _array_u(state,step,numbers,start=0,stop=None):
+  '''Applies a single qubit gate (such as ry and y) with matrix `numbers` to the qubit for which pairs of elements differ by `step`.'''
+  re,im = state
+  (u00,u01),(u10,u11) = numbers
+  for b in range(start,stop or len(re),2*step):
+    for b0 in range(b,b+step):
+      b1 = b0+step
+      x = complex(re[b0],im[b0])
+      y = complex(re[b1],im[b1])
+      x,y = u00*x+u01*y,u10*x+u11*y
+      re[b0],im[b0],re[b1],im[b1] = x.real,x.imag,y.real,y.imag
+  return state
+
+def _array_controlled(state,where,numbers,start=0,stop=None):
+  '''Applies a cx (if `numbers` is None) or a crx (for which `numbers` holds the cosine and sine of half the angle).
+  This also applies a pswap, for which the pairs differ on the source bit as well as the target bit.'''
+  re,im = state
+  (hi,h,lo,s,l,t) = where
+  # The pairs are the elements with a '1' on the source bit, which differ only on the target bit.
+  # Blocks of `hi` and `lo` elements are stepped over so that the highest and lowest of these two bits are '0' for `i1`.
+  for i2 in range(start,stop or len(re),hi):
+    for i1 in range(i2,i2+h,lo):
+      base = i1+s
+      if numbers is None: # For cx, swap the runs of `l` consecutive elements.
+        b0,b1 = base,base+t
+        re[b0:b0+l],re[b1:b1+l] = re[b1:b1+l],re[b0:b0+l]
+        im[b0:b0+l],im[b1:b1+l] = im[b1:b1+l],im[b0:b0+l]
+      else:
+        c,sn = numbers
+        for b0 in range(base,base+l):
+          b1 = b0+t
+          x0,x1,y0,y1 = re[b0],im[b0],re[b1],im[b1]
+          re[b0],im[b0] = x0*c+y1*sn,x1*c-y0*sn
+          re[b1],im[b1] = y0*c+x1*sn,y1*c-x0*sn
+  return state
+
+
+# For the 'numpy' engine, the state is a NumPy array of shape (2,)*n, for which qubit `j` corresponds to axis `n-1-j`.
+# Here `where` is the pair of indices for the subarrays on which the target qubit is '0' and '1' (and any source qubit is '1').
+
+def _numpy_init(state,where,numbers):
+  '''Replaces the state with a copy of the initial state in `numbers`.'''
+  return numbers.reshape(where).copy()
+
+def _numpy_x(psi,where,numbers):
+  '''Applies an x (or a cx) to the subarrays given by `where`.'''
+  idx0,idx1 = where
+  a0 = psi[idx0].copy()
+  psi[idx0] = psi[idx1]
+  psi[idx1] = a0
+  return psi
+
+def _numpy_h(psi,where,numbers):
+  '''Applies an h to the subarrays given by `where`.'''
+  idx0,idx1 = where
+  a0,a1 = psi[idx0].copy(),psi[idx1].copy()
+  psi[idx0] = r2*(a0+a1)
+  psi[idx1] = r2*(a0-a1)
+  return psi
+
+def _numpy_rx(psi,where,numbers):
+  '''Applies an rx (or a crx) to the subarrays given by `where`, where `numbers` holds the cosine and sine of half the angle.'''
+  idx0,idx1 = where
+  c,s = numbers
+  a0,a1 = psi[idx0].copy(),psi[idx1].copy()
+  psi[idx0] = c*a0-1j*s*a1
+  psi[idx1] = c*a1-1j*s*a0
+  return psi
+
+def _numpy_diag(psi,where,numbers):
+  '''Applies a diagonal gate with matrix `numbers` to the subarrays given by `where`.'''
+  idx0,idx1 = where
+  (u00,_),(_,u11) = numbers
+  psi[idx0] *= u00
+  psi[idx1] *= u11
+  return psi
+
+def _numpy_u(psi,where,numbers):
+  '''Applies a single qubit gate with matrix `numbers` to the subarrays given by `where`.'''
+  idx0,idx1 = where
+  (u00,u01),(u10,u11) = numbers
+  a0,a1 = psi[idx0].copy(),psi[idx1].copy()
+  psi[idx0] = u00*a0+u01*a1
+  psi[idx1] = u10*a0+u11*a1
+  return psi
+
+
+def _value(theta,values):
+  '''Returns the value of the angle `theta`, which may be a `Parameter` that takes its value from the dictionary `values`.'''
+  if isinstance(theta,Parameter):
+    return theta.bind(values)
+  return float(theta)
+
+
+def _is_parameterized(gate):
+  '''Determines whether any angle in the given gate is a `Parameter`.'''
+  return any([isinstance(e,Parameter) for e in gate])
+
+
+def _thread_count():
+  '''Returns the number of threads to be used by the 'array' engine: `simulation_threads` if it is set, or otherwise one for each processor on IronPython (where threads really run in parallel) and just one elsewhere.'''
+  if simulation_threads:
+    return simulation_threads
+  if sys.platform=='cli':
+    try:
+      import System
+      return System.Environment.ProcessorCount
+    except ImportError:
+      pass
+  return 1
+
+
+class _WorkerPool:
+  '''A fixed set of threads, which wait for functions to be given to `run`.'''
+  
+  def __init__(self,size):
+    self.tasks = queue.Queue()
+    for _ in range(size):
+      worker = threading.Thread(target=self._work)
+      worker.daemon = True
+      worker.start()
+  
+  def _work(self):
+    while True:
+      task,results = self.tasks.get()
+      try:
+        task()
+        results.put(None)
+      except Exception as error:
+        results.put(error)
+  
+  def run(self,tasks):
+    '''Runs the given functions in parallel, and returns once all of them are done. Any error raised by one of them is raised again here.'''
+    results = queue.Queue()
+    for task in tasks:
+      self.tasks.put((task,results))
+    errors = [results.get() for _ in tasks]
+    for error in errors:
+      if error is not None:
+        raise error
+
+# The worker pools, for each use and number of threads, which are created when first needed.
+_worker_pools = {}
+_worker_pools_lock = threading.Lock()
+
+def _worker_pool(size,use='simulation'):
+  '''Returns the worker pool with the given number of threads for the given use.
+  Tasks run by one pool must only wait for tasks in a pool for a different use, since those of their own pool could be waiting behind them.'''
+  key = (use,size)
+  with _worker_pools_lock:
+    if key not in _worker_pools:
+      _worker_pools[key] = _WorkerPool(size)
+    return _worker_pools[key]
+
+
+class CompiledCircuit:
+  '''A circuit that has been prepared to be simulated many times with the 'array' or 'numpy' engine.
+  The gates are converted into a plan that holds the function used to apply each one, the index strides that it requires, and the trigonometric values (or matrices) for all fixed angles.
+  Angles given by a `Parameter` can be set with `bind`, without needing to compile again.
+  Compiled circuits can be used with `simulate` in the same way as uncompiled ones.'''
+  
+  def __init__(self,qc,engine=None,optimized=True):
+    '''Creates the plan for the given circuit, for the given engine (or `default_engine` if none is given).'''
+    if engine is None:
+      engine = default_engine
+    assert engine in ['array','numpy'], 'Compiled circuits can only be run with the array or numpy engines.'
+    assert engine in engines, 'Unknown simulation engine '+str(engine)+'.'
+    self.engine = engine
+    # The same attributes as for QuantumCircuit objects are kept, so that the outputs can be calculated by `simulate`.
+    self.num_qubits = qc.num_qubits
+    self.num_clbits = qc.num_clbits
+    self.name = qc.name
+    self.data = list(qc.data)
+    # The values of the parameters.
+    self.values = {}
+    
+    run_qc = optimize(qc) if optimized else qc
+    self.gates_removed = len(qc.data)-len(run_qc.data)
+    self.parameters = []
+    self.plan = []
+    for gate in run_qc.data:
+      if gate[0]!='m':
+        for e in gate:
+          if isinstance(e,Parameter) and e.name not in self.parameters:
+            self.parameters.append(e.name)
+        self.plan.append(self._compile_gate(gate))
+  
+  def _numbers(self,gate,values):
+    '''Returns the values that depend on the angle of the gate: the cosine and sine of half the angle for rx and crx, or the matrix for other single qubit gates.'''
+    if gate[0] in ['rx','crx']:
+      theta = _value(gate[1],values)
+      return cos(theta/2),sin(theta/2)
+    elif gate[0]=='pswap':
+      theta = pi*_value(gate[1],values)
+      return cos(theta/2),sin(theta/2)
+    elif gate[0] in single_qubit_gates:
+      if gate[0] in ['rz','ry']:
+        gate = (gate[0],_value(gate[1],values),gate[2])
+      return _single_qubit_matrix(gate)
+  
+  def _compile_gate(self,gate):
+    '''Returns the kernel function, index strides and angle dependent values for the given gate, followed by the gate itself and whether the values must instead be calculated when the circuit is run.'''
+    n = self.num_qubits
+    use_numpy = self.engine=='numpy'
+    
+    if gate[0]=='init':
+      if isinstance(gate[1],ProductState):
+        if use_numpy:
+          return (_numpy_init,(2,)*n,gate[1]._expand_numpy(),gate,False)
+        k = [complex(e) for e in gate[1].expand()]
+        return (_array_init,None,(array('d',[e.real for e in k]),array('d',[e.imag for e in k])),gate,False)
+      elif use_numpy:
+        k = np.array(gate[1])
+        if k.ndim==2: # Complex numbers given as a list of two real numbers.
+          k = k[:,0]+1j*k[:,1]
+        else:
+          k = k.astype(complex)
+        return (_numpy_init,(2,)*n,k,gate,False)
+      elif type(gate[1][0])==list:
+        return (_array_init,None,(array('d',[e[0] for e in gate[1]]),array('d',[e[1] for e in gate[1]])),gate,False)
+      else: # This allows for simple lists of real (or complex) numbers to be accepted as input.
+        k = [complex(e) for e in gate[1]]
+        return (_array_init,None,(array('d',[e.real for e in k]),array('d',[e.imag for e in k])),gate,False)
+    
+    assert gate[0] in single_qubit_gates+['cx','crx','pswap'], 'Gate '+str(gate[0])+' is not recognized by the simulator.'
+    
+    numbers = None
+    if not _is_parameterized(gate):
+      numbers = self._numbers(gate,{})
+    
+    if gate[0] in single_qubit_gates:
+      j = gate[-1]
+      if use_numpy:
+        where = (self._index({j:0}),self._index({j:1}))
+      else:
+        where = 2**j
+      if gate[0]=='x':
+        kernel = _numpy_x if use_numpy else _array_x
+      elif gate[0]=='h':
+        kernel = _numpy_h if use_numpy else _array_h
+      elif gate[0]=='rx':
+        kernel = _numpy_rx if use_numpy else _array_rx
+      elif gate[0] in ['rz','z','s','t'] or (numbers is not None and numbers[0][1]==0 and numbers[1][0]==0):
+        kernel = _numpy_diag if use_numpy else _array_diag
+      else:
+        kernel = _numpy_u if use_numpy else _array_u
+    
+    else:
+      [s,t] = gate[-2:]
+      # The pswap gate rotates between elements with a '1' on only the source bit and those with a '1' on only the target bit.
+      t1 = 0 if gate[0]=='pswap' else 1
+      if use_numpy:
+        where = (self._index({s:1,t:0}),self._index({s:t1,t:1}))
+        kernel = _numpy_x if gate[0]=='cx' else _numpy_rx
+      else:
+        [l,h] = sorted([s,t])
+        where = (2**(h+1),2**h,2**(l+1),2**s,2**l,2**t-(1-t1)*2**s)
+        kernel = _array_controlled
+    
+    return (kernel,where,numbers,gate,numbers is None and _is_parameterized(gate))
+  
+  def _index(self,bits):
+    '''Returns the index of the subarray for which each qubit in the dictionary `bits` has the given value.'''
+    idx = [slice(None)]*self.num_qubits
+    for q in bits:
+      idx[self.num_qubits-1-q] = bits[q]
+    return tuple(idx)
+  
+  def bind(self,values):
+    '''Sets the values of parameters, using a dictionary with parameter names (or the parameters themselves) as keys, and returns the compiled circuit.'''
+    for name in values:
+      self.values[getattr(name,'name',name)] = values[name]
+    return self
+  
+  def run(self):
+    '''Runs the plan, and returns the real and imaginary parts of the final statevector.
+    With the 'array' engine, the work is split between threads if `_thread_count` gives more than one (and the circuit has at least `threading_min_qubits` qubits).'''
+    n = self.num_qubits
+    # Start in the all |0> state.
+    if self.engine=='numpy':
+      state = np.zeros((2,)*n,dtype=complex)
+      state[(0,)*n] = 1.0
+    else:
+      state = (array('d',[0.0])*2**n,array('d',[0.0])*2**n)
+      state[0][0] = 1.0
+      # The statevector is split into 2**k chunks, with k the largest for which there are enough threads and the chunks are not too small.
+      threads = _thread_count()
+      k = 0
+      while 2**(k+1)<=threads and n-k-1>=threading_min_qubits:
+        k += 1
+      last_simulation['threads'] = 2**k
+      if k:
+        return self._run_threaded(state,k,threads)
+    for (kernel,where,numbers,gate,parameterized) in self.plan:
+      if parameterized: # Values that depend on parameters are calculated only now.
+        numbers = self._numbers(gate,self.values)
+      state = kernel(state,where,numbers)
+    if self.engine=='numpy':
+      k = state.reshape(2**n)
+      return k.real,k.imag
+    return state
+  
+  def _run_threaded(self,state,k,threads):
+    '''Runs the plan with the 'array' engine, with the statevector split into 2**k chunks by the values of the k highest qubits.
+    Consecutive gates that do not act on these qubits never pair elements from different chunks, so each chunk is given to a thread that applies all of these gates to it.
+    Any other gate is applied to the whole statevector, once the threads have finished.'''
+    n = self.num_qubits
+    size = 2**(n-k)
+    pool = _worker_pool(threads)
+    
+    def apply(state,segment,start):
+      '''Returns a function that applies the given gates to the chunk that begins at `start`.'''
+      def task():
+        for (kernel,where,numbers) in segment:
+          kernel(state,where,numbers,start,start+size)
+      return task
+    
+    segment = []
+    for (kernel,where,numbers,gate,parameterized) in self.plan:
+      if parameterized:
+        numbers = self._numbers(gate,self.values)
+      qubits = _gate_qubits(gate)
+      if gate[0]!='init' and qubits and max(qubits)<n-k:
+        segment.append((kernel,where,numbers))
+      else:
+        if segment:
+          pool.run([apply(state,segment,start) for start in range(0,2**n,size)])
+          segment = []
+        state = kernel(state,where,numbers)
+    if segment:
+      pool.run([apply(state,segment,start) for start in range(0,2**n,size)])
+    return state
+
+
+def compile(qc,engine=None,optimized=True):
+  '''Returns a `CompiledCircuit` for `qc`, which can be simulated many times (with different values for any parameters) without repeating the preparation.'''
+  return CompiledCircuit(qc,engine,optimized)
+
+
+def _evolve_arrays(qc):
+  '''Applies the gates of `qc` to a statevector stored as two flat `array('d')` buffers, one for the real parts and one for the imaginary parts, and returns them.'''
+  return CompiledCircuit(qc,'array',optimized=False).run()
+
+
+def _evolve_numpy(qc):
+  '''Applies the gates of `qc` to a statevector stored as a NumPy array of shape (2,)*n, and returns the real and imaginary parts as NumPy arrays.'''
+  return CompiledCircuit(qc,'numpy',optimized=False).run()
+
+
+def _gate_qubits(gate):
+  '''Returns the qubits on which the given gate acts, or None if it should be treated as acting on all of them.'''
+  if gate[0] in single_qubit_gates:
+    return [gate[-1]]
+  elif gate[0] in ['cx','crx','pswap']:
+    return list(gate[-2:])
+  elif gate[0]=='m':
+    return []
+
+
+def _is_factored(qc):
+  '''Determines whether the circuit is initialized with a `ProductState`, with no further initialization.'''
+  inits = [gate for gate in qc.data if gate[0]=='init']
+  return len(inits)==1 and qc.data[0]==inits[0] and isinstance(inits[0][1],ProductState)
+
+
+def evolve_factors(qc,engine=None,optimized=True):
+  '''For a circuit that is initialized with a `ProductState` (and has no further initialization), applies the gates to each factor separately and returns the final state as a `ProductState`.
+  Factors are combined only when a gate acts on qubits in more than one of them, so a factor on which no such gates act is never expanded.
+  The `engine` and `optimized` arguments are as for `simulate`.'''
+  assert _is_factored(qc), 'The circuit must be initialized with a ProductState.'
+  if engine is None:
+    engine = default_engine
+  run_qc = optimize(qc) if optimized else qc
+  
+  # Each group of factors is described by its lowest qubit, its number of qubits and its factors, starting with those on the highest qubits.
+  init = run_qc.data[0][1]
+  groups = []
+  lowest = run_qc.num_qubits
+  for factor,size in zip(init.factors,init.num_qubits()):
+    lowest -= size
+    groups.append([lowest,size,[factor]])
+  
+  def find(q):
+    '''Returns the position in `groups` of the group that contains qubit `q`.'''
+    for j,(lo,size,_) in enumerate(groups):
+      if lo<=q<lo+size:
+        return j
+  
+  # Groups are merged when a gate acts on more than one (along with any in between, to keep the qubits in order).
+  for gate in run_qc.data[1:]:
+    qubits = _gate_qubits(gate)
+    if qubits is None:
+      js = [0,len(groups)-1]
+    else:
+      js = [find(q) for q in qubits]
+    if js and min(js)!=max(js):
+      j0,j1 = min(js),max(js)
+      merged = [groups[j1][0],sum([g[1] for g in groups[j0:j1+1]]),sum([g[2] for g in groups[j0:j1+1]],[])]
+      groups[j0:j1+1] = [merged]
+  
+  # A circuit is then created and run for each group.
+  circuits = []
+  for (lo,size,factors) in groups:
+    sub_qc = QuantumCircuit(size)
+    sub_qc.data = [('init',ProductState(*factors))]
+    circuits.append(sub_qc)
+  for gate in run_qc.data[1:]:
+    qubits = _gate_qubits(gate)
+    if qubits is None: # All groups will have been merged for this gate.
+      circuits[0].data.append(gate)
+    elif qubits:
+      j = find(qubits[0])
+      lo = groups[j][0]
+      circuits[j].data.append(gate[:len(gate)-len(qubits)]+tuple([q-lo for q in qubits]))
+  
+  kets = []
+  for sub_qc in circuits:
+    init = sub_qc.data[0][1]
+    if len(sub_qc.data)==1: # Factors with no gates are used directly.
+      kets.append(init.factors[0] if len(init.factors)==1 else init.expand())
+    else:
+      re,im = engines[engine](sub_qc)
+      if np is not None and isinstance(re,np.ndarray):
+        kets.append(re+1j*im)
+      else:
+        kets.append([complex(re[j],im[j]) for j in range(len(re))])
+  return ProductState(*kets)
+
+
+# The engines that `simulate` can use to apply the gates, each of which returns the real and imaginary parts of the final statevector.
+engines = {'list':_evolve_lists,'array':_evolve_arrays}
+if np is not None:
+  engines['numpy'] = _evolve_numpy
+
+# The engine used when none is given: NumPy if it could be imported, or otherwise the pure Python array engine.
+default_engine = 'numpy' if np is not None else 'array'
+
+# The number of threads used by the 'array' engine. If None, this is the number of processors on IronPython, and one elsewhere (since the global interpreter lock stops threads running in parallel).
+simulation_threads = None
+# The smallest number of qubits for each part of the statevector given to a thread, so that small simulations are done in a single thread.
+threading_min_qubits = 10
+
+# Information about the most recent call of `simulate`: the engine used, how many gates were removed by `optimize`, how many parts the statevector was split into for threads, and whether the results were taken from the cache.
+last_simulation = {'engine':None,'gates_removed':0,'threads':1,'cached':False}
+
+
+def _probabilities(re,im):
+  '''Returns a flat `array('d')` of the probabilities for a statevector with the given real and imaginary parts.'''
+  if np is not None and isinstance(re,np.ndarray):
+    probs = array('d')
+    if hasattr(probs,'frombytes'):
+      probs.frombytes((re*re+im*im).tobytes())
+    else:
+      probs.fromstring((re*re+im*im).tostring())
+    return probs
+  return array('d',[re[j]**2+im[j]**2 for j in range(len(re))])
+
+
+def _sample(probs,shots,rng=None):
+  '''Returns a list of `shots` samples from the given probabilities, as the integers for the chosen elements.
+  The samples are found by a binary search of the cumulative distribution, using random numbers from `rng` (or the `random` module, if not given, so that `random.seed` makes them reproducible).
+  With NumPy, the search is done for all samples at once, and gives the same samples as without it. The random numbers are then taken from `rng` in one go if it is a NumPy generator.'''
+  rng = rng or random
+  if np is not None:
+    cumulative = np.cumsum(probs)
+    if isinstance(rng,_numpy_generators):
+      randoms = rng.random(shots)
+    else:
+      randoms = np.array([rng.random() for _ in range(shots)])
+    samples = np.searchsorted(cumulative,randoms*cumulative[-1],side='right')
+    return np.minimum(samples,len(cumulative)-1).tolist()
+  cumulative = []
+  total = 0
+  for p in probs:
+    total += p
+    cumulative.append(total)
+  last = len(cumulative)-1
+  return [min(bisect_right(cumulative,rng.random()*total),last) for _ in range(shots)]
+
+
+def _state_bytes(k):
+  '''Returns the real and imaginary parts of the elements of the statevector `k` as bytes, in the same form however the elements are given.'''
+  if np is not None:
+    k = np.asarray(k)
+    # Complex numbers given as a list of two real numbers are already in the same form as a complex array.
+    return k.astype(float if k.ndim==2 else complex).tobytes()
+  if type(k[0])==list:
+    parts = array('d',[x for e in k for x in e])
+  else:
+    parts = array('d',[0.0])*(2*len(k))
+    try: # Real amplitudes (the most common case) can be converted in one go.
+      parts[0::2] = array('d',k)
+    except TypeError:
+      k = [complex(e) for e in k]
+      parts[0::2] = array('d',[e.real for e in k])
+      parts[1::2] = array('d',[e.imag for e in k])
+  return parts.tobytes() if hasattr(parts,'tobytes') else parts.tostring()
+
+
+def fingerprint(qc):
+  '''Returns a string that identifies the statevector created by the gates of `qc`, which is the same for any circuit with the same number of qubits and the same gates in the same order.
+  Initial states are included by a digest of their elements (or of each factor, for a `ProductState`), which is calculated every time so that changes made to them in place are seen. Measurements are ignored, since they do not affect the statevector.'''
+  digest = hashlib.sha1()
+  digest.update(('qubits:'+str(qc.num_qubits)).encode())
+  for gate in qc.data:
+    if gate[0]=='init':
+      factors = gate[1].factors if isinstance(gate[1],ProductState) else [gate[1]]
+      digest.update(('init:'+str(len(factors))).encode())
+      for k in factors:
+        digest.update(hashlib.sha1(_state_bytes(k)).digest())
+    elif gate[0]!='m':
+      digest.update(repr(gate).encode())
+  return digest.hexdigest()
+
+
+# The maximum number of circuits for which `simulate` keeps the final statevector, and (separately) the probabilities, so that circuits it has already run need not be run again.
+# The total size of these is also limited to `simulation_cache_bytes`. The least recently used are removed first.
+simulation_cache_size = 8
+simulation_cache_bytes = 2**26
+_statevector_cache = OrderedDict()
+_probability_cache = OrderedDict()
+_simulation_cache_lock = threading.Lock()
+
+# The number of times `simulate` found the results for a circuit in the cache (or did not), and the number of bytes that the cache currently holds.
+simulation_cache_info = {'hits':0,'misses':0,'bytes':0}
+
+def _nbytes(value):
+  '''Returns the number of bytes of the arrays in a value kept by the simulation cache.'''
+  return sum([8*len(part) for part in value[:-1]])
+
+def _cache_get(cache,key):
+  '''Returns the value for `key` in the given cache (or None), and records that it was the most recently used.'''
+  if key not in cache:
+    return None
+  value = cache.pop(key)
+  cache[key] = value
+  return value
+
+def _cache_put(cache,key,value):
+  '''Adds the value for `key` to the given cache, and removes the least recently used values beyond `simulation_cache_size` or `simulation_cache_bytes`.'''
+  size = _nbytes(value)
+  if size>simulation_cache_bytes or key in cache:
+    return
+  cache[key] = value
+  simulation_cache_info['bytes'] += size
+  while len(cache)>simulation_cache_size or simulation_cache_info['bytes']>simulation_cache_bytes:
+    other = _probability_cache if cache is _statevector_cache else _statevector_cache
+    # When the limit on bytes is exceeded, the oldest values are removed from whichever cache is the largest.
+    if len(cache)<=simulation_cache_size and len(other)>len(cache):
+      _,old = other.popitem(last=False)
+    else:
+      _,old = cache.popitem(last=False)
+    simulation_cache_info['bytes'] -= _nbytes(old)
+
+def clear_simulation_cache():
+  '''Removes all results kept by `simulate`, and resets the numbers in `simulation_cache_info`.'''
+  with _simulation_cache_lock:
+    _statevector_cache.clear()
+    _probability_cache.clear()
+    simulation_cache_info.update({'hits':0,'misses':0,'bytes':0})
+
+
+def simulate(qc,shots=1024,get='counts',engine=None,optimized=True,rng=None):
+  '''Simulates the given circuit `qc`, and outputs the results in the form specified by `shots` and `get`.
+  The `engine` determines how the statevector is stored during the simulation: 'numpy' uses a NumPy array, 'array' uses flat buffers updated in place, and 'list' uses a list of [real,imaginary] pairs.
+  If no engine is given, `default_engine` is used.
+  If `optimized`, the gates are first reduced using `optimize`. The number of gates removed is recorded in `last_simulation`.
+  The circuit can also be a `CompiledCircuit`, in which case its own engine and optimization are used.
+  The 'array' engine can split the work between threads, as set by `simulation_threads`. The number of parts into which the statevector was split is recorded in `last_simulation`.
+  The results for recently run circuits (other than compiled ones) are kept, as set by `simulation_cache_size`, and used whenever a circuit with the same `fingerprint` is simulated with the same engine and optimization. Whether this was done is recorded in `last_simulation`.
+  For the 'counts' and 'memory' outputs, the random numbers come from the `random` module, so `random.seed` makes the sampling reproducible. An instance of `random.Random` (or a NumPy generator) can instead be given as `rng`.'''
+  
+  last_simulation['threads'] = 1
+  
+  # Look for the results in the cache. Probabilities are only used if the statevector is not required.
+  # Each cached value also holds the number of gates removed by `optimize`.
+  key = None
+  found = False
+  re = im = probs = None
+  if simulation_cache_size and simulation_cache_bytes and not isinstance(qc,CompiledCircuit):
+    key = (fingerprint(qc),engine or default_engine,bool(optimized))
+    with _simulation_cache_lock:
+      if get!='statevector':
+        cached = _cache_get(_probability_cache,key)
+        if cached is not None:
+          probs,gates_removed = cached
+      if probs is None:
+        cached = _cache_get(_statevector_cache,key)
+        if cached is not None:
+          re,im,gates_removed = cached
+      found = probs is not None or re is not None
+      simulation_cache_info['hits' if found else 'misses'] += 1
+    engine = key[1]
+  
+  if isinstance(qc,CompiledCircuit):
+    engine = qc.engine
+    gates_removed = qc.gates_removed
+    re,im = qc.run()
+  elif not found:
+    if engine is None:
+      engine = default_engine
+    assert engine in engines, 'Unknown simulation engine '+str(engine)+'.'
+    run_qc = optimize(qc) if optimized else qc
+    gates_removed = len(qc.data)-len(run_qc.data)
+    if _is_factored(run_qc): # Product states are kept factored for as long as possible.
+      state = evolve_factors(run_qc,engine,optimized=False)
+      if engine=='numpy':
+        k = state._expand_numpy() if len(state.factors)>1 else np.asarray(state.factors[0],dtype=complex)
+        re,im = k.real,k.imag
+      else:
+        k = [complex(e) for e in state.expand()]
+        re,im = array('d',[e.real for e in k]),array('d',[e.imag for e in k])
+    else:
+      re,im = engines[engine](run_qc)
+    if key is not None:
+      with _simulation_cache_lock:
+        _cache_put(_statevector_cache,key,(re,im,gates_removed))
+  
+  last_simulation['engine'] = engine
+  last_simulation['gates_removed'] = gates_removed
+  last_simulation['cached'] = found
+
+  # The `outputnum_clbitsap` dictionary keeps track of which qubits are read out to which output bits
+  outputnum_clbitsap = {}
+  for gate in qc.data:
+    if gate[0]=='m': # For measurement, keep a record of which bit goes with which qubit.
+      outputnum_clbitsap[gate[2]] = gate[1]
   
   # Now for the outputs.
     
   # For the statevector output, simply return the statevector.
   if get=='statevector':
-    return k
+    if np is not None and isinstance(re,np.ndarray):
+      return np.stack([re,im],axis=1).tolist()
+    return [[re[j],im[j]] for j in range(len(re))]
 
   else:
         
     # To calculate outputs, we convert the statevector into a list of probabilities.
     # Here `probs[j]` is the probability for the output bit string to be the n bit representation of j.
-    probs = [e[0]**2+e[1]**2 for e in k]
+    if probs is None:
+      probs = _probabilities(re,im)
+      if key is not None:
+        with _simulation_cache_lock:
+          _cache_put(_probability_cache,key,(probs,gates_removed))
+    if key is not None: # A copy is used, so that changes to the output do not affect the cache.
+      probs = array('d',probs)
         
     # This can be output directly (as with Statevector or DensityMatrix in Qiskit
-    if get=='probabilities_dict':
+    if get=='probabilities':
+      # A flat array, with `probs[j]` the probability for the n bit representation of j.
+      return probs
+    elif get=='probabilities_dict':
       # For each p=probs[j], the key is the n bit representation of j, and the value is p.
       return {('{0:0'+str(qc.num_qubits)+'b}').format(j):p for j,p in enumerate(probs)}
     # Otherwise, we need to sample
@@ -186,33 +1154,26 @@ def simulate(qc,shots=1024,get='counts'):
           assert  not ((gate[-1]==j) and m[j]), 'Incorrect or missing measure command.'
           m[j] = (gate==('m',j,j))
         
-      # The `shots` samples that result are then collected in the list `m`.
-      m=[]
-      for _ in range(shots):
-        cumu=0
-        un=True
-        r=random.random()
-        for j,p in enumerate(probs):
-          cumu += p
-          if r<cumu and un:    
-            # When the `j`th element is chosen, get the n bit representation of j.
-            raw_out=('{0:0'+str(qc.num_qubits)+'b}').format(j)
-            # Convert this into an m bit string, with the order specified by the measure commands
-            out_list = ['0']*qc.num_clbits
-            for bit in outputnum_clbitsap:
-              out_list[qc.num_clbits-1-bit] = raw_out[qc.num_qubits-1-outputnum_clbitsap[bit]]
-            out = ''.join(out_list)
-            # Add this to the list of samples
-            m.append(out)
-            un=False
+      # The `shots` samples are taken as integers, and each distinct result is converted into a bit string only once.
+      samples = _sample(probs,shots,rng)
+      outputs = {}
+      for j in set(samples):
+        # When the `j`th element is chosen, get the n bit representation of j.
+        raw_out=('{0:0'+str(qc.num_qubits)+'b}').format(j)
+        # Convert this into an m bit string, with the order specified by the measure commands
+        out_list = ['0']*qc.num_clbits
+        for bit in outputnum_clbitsap:
+          out_list[qc.num_clbits-1-bit] = raw_out[qc.num_qubits-1-outputnum_clbitsap[bit]]
+        outputs[j] = ''.join(out_list)
             
-      # For the memory output, we simply return `m`
+      # For the memory output, we simply return the list of samples
       if get=='memory':
-        return m
+        return [outputs[j] for j in samples]
       # For the counts output, we turn it into a counts dictionary first
       else:
         counts = {}
-        for out in m:
+        for j in samples:
+          out = outputs[j]
           if out in counts:
             counts[out] += 1
           else:
@@ -222,4 +1183,35 @@ def simulate(qc,shots=1024,get='counts'):
 
   # Note: Ports should also contain the possibility to get a Qiskit output, which returns a string containing a Python
   # program to create the given circuit qc. This is not needed here, since the same syntax as standard Qiskit is used.
-  # See the C++ port for an example.
\ No newline at end of file
+  # See the C++ port for an example.
+
+def simulate_batch(qc,kets,get='probabilities',engine=None,optimized=True):
+  '''Applies the gates of `qc` to each of the statevectors in the list `kets`, and returns a list of the results in the form specified by `get`: 'statevector', 'probabilities' or 'probabilities_dict'.
+  The circuit should have no initialization of its own. The statevectors are stacked as the blocks of a single larger statevector, with the batch index on extra qubits above those of `qc`, so that the gates are applied to all of them in a single simulation.'''
+  assert get in ['statevector','probabilities','probabilities_dict'], 'Outputs of batched simulations must be statevectors or probabilities.'
+  assert not [gate for gate in qc.data if gate[0]=='init'], 'Circuits for batched simulations must not be initialized.'
+  n = qc.num_qubits
+  N = 2**n
+  m = (len(kets)-1).bit_length()
+  
+  # The initial state is made from the given statevectors, padded with zeros to fill the extra qubits.
+  init = []
+  for k in kets:
+    assert len(k)==N, 'Statevectors must have one element for each basis state of the circuit.'
+    if type(k[0])==list: # Complex numbers given as a list of two real numbers are converted.
+      k = [complex(e[0],e[1]) for e in k]
+    init += [e for e in k]
+  init += [0]*(2**(n+m)-len(init))
+  
+  batch_qc = QuantumCircuit(n+m)
+  batch_qc.initialize(init)
+  batch_qc.data += [gate for gate in qc.data if gate[0]!='m']
+  
+  if get=='statevector':
+    ket = simulate(batch_qc,get='statevector',engine=engine,optimized=optimized)
+    return [ket[b*N:(b+1)*N] for b in range(len(kets))]
+  probs = simulate(batch_qc,get='probabilities',engine=engine,optimized=optimized)
+  batch = [probs[b*N:(b+1)*N] for b in range(len(kets))]
+  if get=='probabilities_dict':
+    return [{('{0:0'+str(n)+'b}').format(j):p for j,p in enumerate(p_b)} for p_b in batch]
+  return batch
@@ -31,7 +31,9 @@ PIL
 
 Otherwise, MicroQiskit will be used in place of Qiskit, and alternative
 techniques using only the standard library will be used in place of the
-other dependencies.
+other dependencies. In this case, MicroQiskit will still use NumPy to run
+its simulations if NumPy can be imported, and will otherwise fall back to
+pure Python.
 
 More information on Qiskit can be found at
 
@@ -43,8 +45,20 @@ https://github.com/qiskit-community/MicroQiskit
 """
 
 import math
-from microqiskit import QuantumCircuit, simulate
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from microqiskit import QuantumCircuit, simulate, simulate_batch, ProductState, evolve_factors
+from microqiskit import _thread_count, _worker_pool
 simple_python = True
+
+# NumPy is used to speed up some of the tools below whenever it is available,
+# even if Qiskit is not
+try:
+    import numpy as np
+except ImportError:
+    np = None
     
 # determine whether qiskit can be used, or whether to default to
 # MicroQiskit and the standard library
@@ -58,6 +72,9 @@ simple_python = True
 #    simple_python = True
 
     
+# number of bytes used for each pixel in the supported image modes
+_image_bands = {'L':1, 'RGB':3, 'RGBA':4}
+
 # this is overwritten by the PIL class if available
 class Image():
     """
@@ -67,31 +84,81 @@ class Image():
     
     To initialize an Image oject, use the `newimage` function.
     
+    As in PIL, the pixel values are stored in a single `bytearray`, row by
+    row, with one byte for each channel of a pixel.
+    
     Attributes:
-        mode (str): If L, pixel values are a single integer. If 'RGB', they
-            are a tuple of three integers.
+        mode (str): If L, pixel values are a single integer. If 'RGB' or
+            'RGBA', they are a tuple of three or four integers.
         size (tuple): Specifies width and height.
     """
     def __init__(self):
         self.mode = None
         self.size = None
-        self._image_dict = None
+        self._data = None
+    def _index(self, xy):
+        (x,y) = xy
+        if not (0<=x<self.size[0] and 0<=y<self.size[1]):
+            raise IndexError('image index out of range')
+        return (y*self.size[0]+x)*_image_bands[self.mode]
     def getpixel(self,xy):
         """
         Returns pixel value at the given coordinate.
         """
-        return self._image_dict[xy]
+        bands = _image_bands[self.mode]
+        j = self._index(xy)
+        if bands==1:
+            return self._data[j]
+        return tuple(self._data[j:j+bands])
     def putpixel(self, xy, value):
         """
         Sets the pixel value at the given coordinate.
         """
-        self._image_dict[xy] = value
+        bands = _image_bands[self.mode]
+        j = self._index(xy)
+        if bands==1:
+            self._data[j] = value
+        else:
+            self._data[j:j+bands] = bytearray(value)
+    def tobytes(self):
+        """
+        Returns the pixel values as bytes, row by row.
+        """
+        return bytes(self._data)
+    def frombytes(self, data):
+        """
+        Sets all pixel values from bytes, in the format given by `tobytes`.
+        """
+        assert len(data)==len(self._data), "Not enough image data."
+        self._data[:] = bytearray(data)
+    def getchannel(self, channel):
+        """
+        Returns an 'L' image containing a single channel of this image.
+        The channel can be specified by index or by name ('R', 'G', 'B' or
+        'A').
+        """
+        if not isinstance(channel, int):
+            channel = self.mode.index(channel)
+        image = newimage('L', self.size)
+        image._data[:] = self._data[channel::_image_bands[self.mode]]
+        return image
+    def putchannel(self, channel, image):
+        """
+        Replaces a single channel of this image with the pixel values of
+        the given 'L' image. The channel can be specified by index or by name.
+        Not present in PIL version.
+        """
+        if not isinstance(channel, int):
+            channel = self.mode.index(channel)
+        self._data[channel::_image_bands[self.mode]] = bytearray(image.tobytes())
     def todict(self):
         """
         Returns dictionary of pixel values with coordinates as keys.
         Not present in PIL version.
         """
-        return self._image_dict
+        return {(x,y):self.getpixel((x,y))\
+                for x in range(self.size[0])\
+                for y in range(self.size[1])}
     def show(self):
         """
         If the PIL version of this class is used, this function creates a PNG
@@ -100,9 +167,53 @@ class Image():
         """
         for x in range(self.size[0]):
             for y in range(self.size[1]):
-                print('('+str(x)+','+str(y)+')'+': '+str(self._image_dict[x,y]))
-    def resize(self, new_size, method):
-        print("This functionality has not been implemented.")
+                print('('+str(x)+','+str(y)+')'+': '+str(self.getpixel((x,y))))
+    def resize(self, new_size, method=None):
+        """
+        Returns a resized copy of the image. Nearest neighbour resampling is
+        used when `method` is 0 (as for PIL's `NEAREST`) or not given, and
+        bilinear interpolation otherwise.
+        """
+        (Lx,Ly) = self.size
+        (new_Lx,new_Ly) = new_size
+        bands = _image_bands[self.mode]
+        image = newimage(self.mode, new_size)
+        if not method:
+            # the source row and column for each row and column of the result
+            xs = [ (x*Lx)//new_Lx for x in range(new_Lx) ]
+            ys = [ (y*Ly)//new_Ly for y in range(new_Ly) ]
+            row_length = new_Lx*bands
+            for y,sy in enumerate(ys):
+                row = self._data[sy*Lx*bands:(sy+1)*Lx*bands]
+                new_row = bytearray(row_length)
+                for b in range(bands):
+                    new_row[b::bands] = bytearray([row[sx*bands+b] for sx in xs])
+                image._data[y*row_length:(y+1)*row_length] = new_row
+        else:
+            # the two source coordinates and weight for each output coordinate
+            def weights(length, new_length):
+                coords = []
+                for k in range(new_length):
+                    pos = min(max((k+0.5)*length/new_length-0.5,0),length-1)
+                    k0 = int(pos)
+                    k1 = min(k0+1,length-1)
+                    coords.append( (k0, k1, pos-k0) )
+                return coords
+            data = self._data
+            new_data = image._data
+            j = 0
+            for (y0,y1,wy) in weights(Ly,new_Ly):
+                for (x0,x1,wx) in weights(Lx,new_Lx):
+                    p00 = (y0*Lx+x0)*bands
+                    p01 = (y0*Lx+x1)*bands
+                    p10 = (y1*Lx+x0)*bands
+                    p11 = (y1*Lx+x1)*bands
+                    for b in range(bands):
+                        top = data[p00+b]*(1-wx) + data[p01+b]*wx
+                        bottom = data[p10+b]*(1-wx) + data[p11+b]*wx
+                        new_data[j] = int(top*(1-wy) + bottom*wy + 0.5)
+                        j += 1
+        return image
 
 # this is overwritten by the PIL function if available               
 def newimage(mode, size):
@@ -112,14 +223,8 @@ def newimage(mode, size):
     """
     img = Image()
     img.mode = mode
-    img.size = size
-    if mode=='L':
-        blank = 0
-    elif mode=='RGB':
-        blank = (0,0,0)
-    img._image_dict = {(x,y):blank\
-                for x in range(size[0])\
-                for y in range(size[1])}
+    img.size = tuple(size)
+    img._data = bytearray(size[0]*size[1]*_image_bands[mode])
     return img
 
 # if external libraries can be used, import the ones we need
@@ -129,6 +234,85 @@ if not simple_python:
     from PIL.Image import new as newimage, Image
 
 
+class HeightMap(object):
+    """
+    A compact alternative to the height dictionaries used throughout this
+    file, which can be used in place of them by all its functions.
+    
+    The heights for an Lx by Ly grid are stored in a single flat
+    `array('d')`, row by row, so that the height for the point (x,y) is
+    `data[y*Lx+x]`. Like a dictionary, heights can also be accessed with
+    `height[x,y]`, and the object can be iterated over to give the
+    coordinates of all points.
+    
+    Attributes:
+        Lx (int): Width of the grid.
+        Ly (int): Height of the grid.
+        data (array): The heights.
+    """
+    __slots__ = ('Lx','Ly','data')
+    def __init__(self, Lx, Ly, data=None):
+        self.Lx = Lx
+        self.Ly = Ly
+        if data is None:
+            self.data = array('d',[0.0])*(Lx*Ly)
+        else:
+            assert len(data)==Lx*Ly, "Data does not match the size of the grid."
+            self.data = array('d',data)
+    @classmethod
+    def fromdict(cls, height):
+        """
+        Creates a height map from a height dictionary.
+        """
+        Lx,Ly = _get_size(height)
+        heightmap = cls(Lx,Ly)
+        for (x,y) in height:
+            heightmap.data[y*Lx+x] = height[x,y]
+        return heightmap
+    @property
+    def size(self):
+        """
+        Width and height of the grid.
+        """
+        return self.Lx,self.Ly
+    def _index(self, xy):
+        (x,y) = xy
+        if not (0<=x<self.Lx and 0<=y<self.Ly):
+            raise KeyError(xy)
+        return y*self.Lx+x
+    def __getitem__(self, xy):
+        return self.data[self._index(xy)]
+    def __setitem__(self, xy, value):
+        self.data[self._index(xy)] = value
+    def __contains__(self, xy):
+        try:
+            self._index(xy)
+            return True
+        except (KeyError,TypeError,ValueError):
+            return False
+    def __iter__(self):
+        for x in range(self.Lx):
+            for y in range(self.Ly):
+                yield (x,y)
+    def __len__(self):
+        return self.Lx*self.Ly
+    def keys(self):
+        return list(self)
+    def values(self):
+        return [self.data[y*self.Lx+x] for (x,y) in self]
+    def items(self):
+        return [((x,y),self.data[y*self.Lx+x]) for (x,y) in self]
+    def get(self, xy, default=None):
+        if xy in self:
+            return self[xy]
+        return default
+    def todict(self):
+        """
+        Returns the equivalent height dictionary.
+        """
+        return dict(self.items())
+
+
 def _kron(vec0,vec1):
     """
     Calculates the tensor product of two vectors.
@@ -144,6 +328,8 @@ def _get_size(height):
     """
     Determines the size of the grid for the given height map.
     """
+    if isinstance(height, HeightMap):
+        return height.size
     Lx = 0
     Ly = 0
     for (x,y) in height:
@@ -152,12 +338,17 @@ def _get_size(height):
     return Lx,Ly
 
 
-def _circuit2probs(qc):
+def _circuit2probs(qc, flat=False):
     """
-    Runs the given circuit, and returns the resulting probabilities.
+    Runs the given circuit, and returns the resulting probabilities. These
+    are a dictionary with bit strings as keys, or a flat array indexed by
+    the integers that the bit strings represent if `flat` is given.
     """
     if simple_python:
-        probs = simulate(qc,get='probabilities_dict')
+        if flat:
+            probs = simulate(qc,get='probabilities')
+        else:
+            probs = simulate(qc,get='probabilities_dict')
     else:
         # separate circuit and initialization
         new_qc = qc.copy()
@@ -171,50 +362,90 @@ def _circuit2probs(qc):
         # then run it
         ket = quantum_info.Statevector(initial_ket)
         ket = ket.evolve(new_qc)
-        probs = ket.probabilities_dict()
+        if flat:
+            probs = ket.probabilities()
+        else:
+            probs = ket.probabilities_dict()
     
     return probs
 
 
 def _image2heights(image):
     """
-    Converts an rgb image into a list of three height dictionaries, one for
+    Converts an rgb (or rgba) image into a list of height maps, one for
     each colour channgel.
     """
     Lx,Ly = image.size
-    heights = [{} for j in range(3)]
-    for x in range(Lx):
-        for y in range(Ly):
-            rgb = image.getpixel((x,y))
-            for j in range(3):
-                heights[j][x,y] = rgb[j]
+    heights = []
+    for j in range(_image_bands.get(image.mode,3)):
+        channel = list(bytearray(image.getchannel(j).tobytes()))
+        heights.append( HeightMap(Lx,Ly,channel) )
 
     return heights
 
 
+def _height2bytes(height, Lx, Ly):
+    """
+    Returns the heights of a height dictionary as a bytearray of brightnesses,
+    row by row, with the maximum height as 255. If all heights are zero, so
+    are the brightnesses.
+    """
+    if isinstance(height, HeightMap):
+        h_max = float(max(height.data))
+        if h_max==0:
+            return bytearray(Lx*Ly)
+        return bytearray([int(255*(h/h_max)) for h in height.data])
+    h_max = float(max(height.values()))
+    pixels = bytearray(Lx*Ly)
+    if h_max==0:
+        return pixels
+    for (x,y) in height:
+        if 0<=x<Lx and 0<=y<Ly:
+            pixels[y*Lx+x] = int(255*(height[x,y]/h_max))
+    return pixels
+
+
 def _heights2image(heights):
     """
-    Constructs an image from a set of three height dictionaries, one for each
-    colour channel.
+    Constructs an image from a set of three (or four) height dictionaries,
+    one for each colour channel.
     """
     Lx,Ly = _get_size(heights[0])
-    h_max = [max(height.values()) for height in heights]
+    bands = len(heights)
 
-    image = newimage('RGB',(Lx,Ly))
-    for x in range(Lx):
-        for y in range(Ly):
-            rgb = []
-            for j,height in enumerate(heights):
-                if (x,y) in height:
-                    h = float(height[x,y])/h_max[j]
-                else:
-                    h = 0
-                rgb.append( int(255*h) )
-            image.putpixel((x,y), tuple(rgb) )
+    pixels = bytearray(bands*Lx*Ly)
+    for j,height in enumerate(heights):
+        pixels[j::bands] = _height2bytes(height, Lx, Ly)
+
+    image = newimage('RGBA' if bands==4 else 'RGB',(Lx,Ly))
+    image.frombytes(bytes(pixels))
 
     return image
 
 
+def _line_bits ( length ):
+    """
+    Number of bits used by `make_line` for a line of the given length.
+    """
+    n = int(math.ceil(math.log(length)/math.log(2)))
+    return max(n,1)
+
+
+def _line_indices ( length ):
+    """
+    Returns the integers represented by the bit strings of `make_line`,
+    along with their length.
+    
+    These are the Gray codes `k^(k>>1)` for each position k, but with the
+    order of the bits reversed (since new bits are added at the end of the
+    strings).
+    """
+    n = _line_bits( length )
+    form = '0'+str(n)+'b'
+    indices = [ int(format(k^(k>>1),form)[::-1],2) for k in range(2**n) ]
+    return indices, n
+
+
 def make_line ( length ):
     """
     Creates a list of bit strings of at least the given length, such
@@ -228,22 +459,10 @@ def make_line ( length ):
         line (list): List of 2^n n-bit strings for n=⌊log_2(length)⌋
     """
     
-    # number of bits required
-    n = int(math.ceil(math.log(length)/math.log(2)))
-    
-    # iteratively build list
-    line = ['0','1']
-    for j in range(n-1):
-        # first append a reverse-ordered version of the current list
-        line = line + line[::-1]
-        # then add a '0' onto the end of all bit strings in the first half
-        for j in range(int(float(len(line))/2)):
-            line[j] += '0'
-        # and a '1' for the second half
-        for j in range(int(float(len(line))/2),int(len(line))):
-            line[j] += '1'
+    indices, n = _line_indices( length )
+    form = '0'+str(n)+'b'
             
-    return line
+    return [ format(index,form) for index in indices ]
 
 
 def normalize(ket):
@@ -302,46 +521,202 @@ def make_grid(Lx,Ly=None):
     return grid, n
 
 
+# maximum number of grid sizes for which `grid_tables` are kept
+grid_cache_size = 16
+_grid_cache = OrderedDict()
+_grid_cache_lock = threading.Lock()
+
+def grid_tables(Lx,Ly=None):
+    """
+    Integer version of `make_grid`, which gives the permutation between the
+    points on an Lx by Ly grid and the basis states of the qubits. The
+    results are cached for the most recently used `grid_cache_size` grids.
+    
+    Args:
+        Lx (int): Width of the lattice (also the height if no Ly is
+            supplied).
+        Ly (int): Height of the lattice if not Lx.
+    
+    Returns:
+        pixel2basis (array): For the point (x,y) on the grid, element
+            `y*Lx+x` is the integer represented by its bit string in
+            `make_grid`.
+        basis2pixel (array): The inverse of `pixel2basis`, with -1 for
+            basis states that do not correspond to a point on the grid.
+        n (int): Length of the bit strings.
+    """
+    if not Ly:
+        Ly = Lx
+    
+    key = (Lx,Ly)
+    with _grid_cache_lock:
+        if key in _grid_cache:
+            # move to the end, as the most recently used
+            tables = _grid_cache.pop(key)
+            _grid_cache[key] = tables
+            return tables
+    
+    index_x, nx = _line_indices( Lx )
+    index_y, ny = _line_indices( Ly )
+    n = nx+ny
+    
+    # the bit strings for x come first, and so are the highest bits
+    pixel2basis = array('l',[0])*(Lx*Ly)
+    basis2pixel = array('l',[-1])*(2**n)
+    for y in range(Ly):
+        for x in range(Lx):
+            pixel = y*Lx+x
+            basis = (index_x[x]<<ny) + index_y[y]
+            pixel2basis[pixel] = basis
+            basis2pixel[basis] = pixel
+    tables = (pixel2basis, basis2pixel, n)
+    
+    with _grid_cache_lock:
+        _grid_cache[key] = tables
+        while len(_grid_cache)>grid_cache_size:
+            _grid_cache.popitem(last=False)
+    
+    return tables
+
+
+def _encoding(heights, log, eps=1e-4):
+    """
+    Returns the parameters needed by `_amplitude` to encode the given list of
+    heights (with None for missing points): `None` for the standard encoding,
+    and the pair `(max_h, min_h)` for the logarithmic encoding.
+    """
+    if not log:
+        return None
+    all_heights = [h for h in heights if h is not None]
+    # normalize heights
+    max_h = max(all_heights)
+    # find minimum (not too small) normalized height
+    min_h = min([float(h)/max_h for h in all_heights if float(h)/max_h > eps])
+    return max_h, min_h
+
+
+def _amplitude(h, encoding):
+    """
+    Returns the (unnormalized) amplitude that encodes the height h, using
+    parameters from `_encoding`.
+    """
+    if encoding is None:
+        return math.sqrt( h )
+    max_h, min_h = encoding
+    # the minimum value defines the base
+    base = 1.0/min_h
+    return math.sqrt(base**((float(h)/max_h)/min_h))
+
+
+# maximum number of bytes of statevectors kept by `height2circuit`, so that
+# height maps that have already been encoded need not be encoded again
+encoding_cache_bytes = 2**26
+_encoding_cache = OrderedDict()
+_encoding_cache_lock = threading.Lock()
+
+# number of times the encoding for `height2circuit` was found in the cache
+# (or not), and the number of bytes that the cache currently holds
+encoding_cache_info = {'hits':0, 'misses':0, 'bytes':0}
+
+def _array_bytes(data):
+    """
+    Returns the contents of an array as bytes.
+    """
+    if hasattr(data,'tobytes'):
+        return data.tobytes()
+    return data.tostring()
+
+
+def _encoding_key(heights, Lx, Ly, log, normalizeManually, eps):
+    """
+    Returns the key for the encoding of the given list of heights (with None
+    for missing points) in `_encoding_cache`. This contains a digest of the
+    heights, rather than the heights themselves.
+    """
+    if not isinstance(heights, array):
+        heights = array('d',[float('nan') if h is None else h for h in heights])
+    digest = hashlib.sha1(_array_bytes(heights)).digest()
+    return (Lx, Ly, bool(log), bool(normalizeManually), eps, digest)
+
+
+def clear_encoding_cache():
+    """
+    Empties the cache of encodings used by `height2circuit`, and resets the
+    numbers in `encoding_cache_info`.
+    """
+    with _encoding_cache_lock:
+        _encoding_cache.clear()
+        encoding_cache_info.update({'hits':0, 'misses':0, 'bytes':0})
+
+
 def height2circuit(height, log=False,  normalizeManually=False, eps=1e-4):
     """
     Converts a dictionary of heights (or brightnesses) on a grid into
     a quantum circuit.
     
     Args:
-        height (dict): A dictionary in which keys are coordinates
-            for points on a grid, and the values are positive numbers of
-            any type.
+        height (dict or HeightMap): A dictionary in which keys are
+            coordinates for points on a grid, and the values are positive
+            numbers of any type.
         log (bool): If given, a logarithmic encoding is used.
             
     Returns:
         qc (QuantumCircuit): A quantum circuit which encodes the
             given height dictionary.
+    
+    The statevectors for the most recently used height maps are cached (up
+    to a total of `encoding_cache_bytes`), so encoding the same heights
+    again with the same options just requires a lookup.
     """
-    # get bit strings for the grid
+    # get the integers for the bit strings of each point on the grid
     Lx,Ly = _get_size(height)
-    grid, n = make_grid(Lx,Ly)
+    pixel2basis, _, n = grid_tables(Lx,Ly)
     
-    # create required state vector
-    state = [0]*(2**n)
-    if log:
-        # normalize heights
-        max_h = max(height.values())
-        height = {pos:float(height[pos])/max_h for pos in height}
-        # find minimum (not too small) normalized height
-        min_h = min([height[pos] for pos in height if height[pos] > eps])
-        # this minimum value defines the base
-        base = 1.0/min_h
-    for bitstring in grid:
-        (x,y) = grid[bitstring]
-        if (x,y) in height:
-            h = height[x,y]
-            if log:
-                state[ int(bitstring,2) ] = math.sqrt(base**(float(h)/min_h))
+    # get the heights for each point (with None for missing points)
+    if isinstance(height, HeightMap):
+        heights = height.data
+    else:
+        heights = [None]*(Lx*Ly)
+        for (x,y) in height:
+            heights[y*Lx+x] = height[x,y]
+    
+    # look for the state vector in the cache
+    state = None
+    key = None
+    if encoding_cache_bytes:
+        key = _encoding_key(heights, Lx, Ly, log, normalizeManually, eps)
+        with _encoding_cache_lock:
+            if key in _encoding_cache:
+                # move to the end, as the most recently used
+                cached = _encoding_cache.pop(key)
+                _encoding_cache[key] = cached
+                encoding_cache_info['hits'] += 1
+                state = list(cached)
             else:
-                state[ int(bitstring,2) ] = math.sqrt( h )
+                encoding_cache_info['misses'] += 1
     
-    if not normalizeManually:
-        state = normalize(state)
+    if state is None:
+        # create required state vector
+        encoding = _encoding(heights, log, eps)
+        state = [0]*(2**n)
+        for (j,h) in zip(pixel2basis,heights):
+            if h is not None:
+                state[ j ] = _amplitude(h, encoding)
+        
+        if not normalizeManually:
+            state = normalize(state)
+        
+        # and add it to the cache, removing the least recently used if needed
+        if key is not None:
+            cached = array('d',state)
+            size = cached.itemsize*len(cached)
+            with _encoding_cache_lock:
+                if size<=encoding_cache_bytes and key not in _encoding_cache:
+                    _encoding_cache[key] = cached
+                    encoding_cache_info['bytes'] += size
+                    while encoding_cache_info['bytes']>encoding_cache_bytes:
+                        _,old = _encoding_cache.popitem(last=False)
+                        encoding_cache_info['bytes'] -= old.itemsize*len(old)
         
     # define and initialize quantum circuit            
     qc = QuantumCircuit(n)
@@ -355,57 +730,85 @@ def height2circuit(height, log=False,  normalizeManually=False, eps=1e-4):
     return qc
 
 
-def probs2height(probs, size=None, log=False, max_h=0):
+def probs2height(probs, size=None, log=False, max_h=0, heightmap=False):
     """
     Extracts a dictionary of heights (or brightnesses) on a grid from
     a set of probabilities for the output of a quantum circuit into
     which the height map has been encoded.
     
     Args:
-        probs (dict): A dictionary with results from running the circuit.
-            With bit strings as keys and either probabilities or counts as
-            values.
+        probs (dict or array): A dictionary with results from running the
+            circuit. With bit strings as keys and either probabilities or
+            counts as values. Alternatively, a flat list or array (such as
+            from `simulate(qc, get='probabilities')`), in which element j is
+            the value for the bit string that represents j.
         size (tuple): Size of the height map to be created. If not given,
             the size is deduced from the number of qubits (assuming a
             square image).
         log (bool): If given, a logarithmic decoding is used.
+        heightmap (bool): If given, a HeightMap is returned instead of a
+            dictionary.
             
     Returns:
-        height (dict): A dictionary in which keys are coordinates
-            for points on a grid, and the values are floats in the
-            range 0 to 1.
+        height (dict or HeightMap): A dictionary in which keys are
+            coordinates for points on a grid, and the values are floats in
+            the range 0 to 1.
     """
     
+    flat = not isinstance(probs, dict)
+    
     # get grid info
     if size:
         (Lx,Ly) = size
     else:
-        Lx = int(2**(len(list(probs.keys())[0])/2))
+        if flat:
+            n = int(round(math.log(len(probs))/math.log(2)))
+        else:
+            n = len(list(probs.keys())[0])
+        Lx = int(2**(n/2))
         Ly = Lx
-    grid,_ = make_grid(Lx,Ly)
     
     # set height to probs value, rescaled such that the maximum is 1
+    if flat:
+        peak = max(probs)
+    else:
+        peak = max( probs.values() )
     if max_h==0:
-        max_h = max( probs.values() )   
+        max_h = peak
+    else:
+        max_h = peak/max_h
+    # the heights are first found for a height map
+    height = HeightMap(Lx,Ly)
+    data = height.data
+    pixel2basis, basis2pixel, n = grid_tables(Lx,Ly)
+    if flat:
+        num = len(probs)
+        for (pixel,j) in enumerate(pixel2basis):
+            if j < num:
+                data[pixel] = float(probs[j])/max_h
     else:
-        max_h = max( probs.values() )/max_h
-    height = {(x,y):0.0 for x in range(Lx) for y in range(Ly)}
-    for bitstring in probs:
-        if bitstring in grid:
-            height[grid[bitstring]] = float(probs[bitstring])/max_h
+        for bitstring in probs:
+            if len(bitstring)==n:
+                pixel = basis2pixel[int(bitstring,2)]
+                if pixel>=0:
+                    data[pixel] = float(probs[bitstring])/max_h
          
     # take logs if required
     if log:
-        min_h = min([height[pos] for pos in height if height[pos] !=0])
-        alt_min_h = min([height[pos] for pos in height])
+        min_h = min([h for h in data if h !=0])
         base = 1/min_h
-        for pos in height:
-            if height[pos]>0:
-                height[pos] = max(math.log(height[pos]/min_h)/math.log(base),0.0)
+        for j,h in enumerate(data):
+            if h>0 and base>1:
+                data[j] = max(math.log(h/min_h)/math.log(base),0.0)
+            elif h>0:
+                # all non-zero heights are the maximum
+                data[j] = 1.0
             else:
-                height[pos] = 0.0
-                        
-    return height
+                data[j] = 0.0
+    
+    if heightmap:
+        return height
+    return height.todict()
     
     
     
@@ -469,15 +872,452 @@ def circuit2height(qc, log=False):
             range 0 to 1.
     """
     
-    probs = _circuit2probs(qc)
+    probs = _circuit2probs(qc, flat=True)
     return probs2height(probs, size=eval(qc.name), log=log)
 
 
+def circuits2heights(circuits, log=False):
+    """
+    Extracts height dictionaries from a list of circuits, such as those
+    for each colour channel of an image.
+    
+    When the circuits differ only in their initialization (as when the same
+    effect has been applied to each), all are simulated together with
+    `simulate_batch`. Otherwise each is run separately.
+    
+    Args:
+        circuits (list): A list of quantum circuits which each encode a
+            height dictionary, as for `circuit2height`.
+        log (bool): If given, a logarithmic decoding is used.
+            
+    Returns:
+        heights (list): A height dictionary for each circuit.
+    """
+    
+    batched = simple_python
+    if batched:
+        for qc in circuits:
+            if not (qc.data and qc.data[0][0]=='init' and type(qc.data[0][1])==list) \
+            or qc.num_qubits!=circuits[0].num_qubits or qc.data[1:]!=circuits[0].data[1:]:
+                batched = False
+    
+    if not batched:
+        return [circuit2height(qc, log=log) for qc in circuits]
+    
+    gates = QuantumCircuit(circuits[0].num_qubits)
+    gates.data = circuits[0].data[1:]
+    batch = simulate_batch(gates, [qc.data[0][1] for qc in circuits])
+    return [probs2height(probs, size=eval(qc.name), log=log) for qc,probs in zip(circuits,batch)]
+
+
+# the number of qubits used by `image2circuit` to select the colour channel
+channel_qubits = 2
+
+def blur_qubits(size, axis=None):
+    """
+    Returns the qubits to be rotated for a blur along the given axis of a
+    height map encoded by `height2circuit`. These never include the qubits
+    that select the colour channel for `image2circuit`.
+    
+    The bit strings for each point are made from those for the x and y
+    coordinates, with y on the lowest qubits. Rotating only the qubits for
+    x therefore mixes amplitudes only within each row of the image, and
+    rotating only those for y mixes them only within each column.
+    
+    Args:
+        size (tuple): Width and height of the height map.
+        axis (str): Either 'x' (for a horizontal blur), 'y' (for a vertical
+            blur) or None (for both).
+    
+    Returns:
+        qubits (list): The qubits to rotate.
+    """
+    (Lx,Ly) = size
+    nx = _line_bits( Lx )
+    ny = _line_bits( Ly )
+    assert axis in [None,'x','y'], "Axis should be 'x', 'y' or None."
+    if axis=='x':
+        return list(range(ny,nx+ny))
+    elif axis=='y':
+        return list(range(ny))
+    return list(range(nx+ny))
+
+
+def circuit_blur_qubits(qc, axis=None):
+    """
+    Returns the qubits to be rotated for a blur of the given circuit. If the
+    name of the circuit gives the size of a height map encoded by
+    `height2circuit` or `image2circuit` (and the number of qubits matches),
+    these are as for `blur_qubits`, and so leave out the qubits for the
+    colour channel. Otherwise, all qubits are rotated.
+    
+    Args:
+        qc (QuantumCircuit): The circuit to blur.
+        axis (str): If 'x' or 'y', the blur is only along this axis, for
+            which the circuit must be named with its size.
+    
+    Returns:
+        qubits (list): The qubits to rotate.
+    """
+    try:
+        size = eval(qc.name)
+        n = grid_tables(*size)[2]
+    except Exception:
+        size = None
+    if axis is not None:
+        assert size is not None, "Circuits blurred along an axis should be named with their size."
+        return blur_qubits(size, axis)
+    if size is not None and qc.num_qubits in [n, n+channel_qubits]:
+        return blur_qubits(size)
+    return list(range(qc.num_qubits))
+
+
+def _walsh_hadamard(re, im, qubits=None):
+    """
+    Applies an (unnormalized) Walsh-Hadamard transform in place to the
+    statevector with the given real and imaginary parts, stored as two
+    `array('d')` buffers. If a list of qubits is given, the transform is
+    only applied to these.
+    """
+    N = len(re)
+    if qubits is None:
+        qubits = range(int(round(math.log(N)/math.log(2))))
+    for q in qubits:
+        h = 2**q
+        for b in range(0,N,2*h):
+            for b0 in range(b,b+h):
+                b1 = b0+h
+                x0,x1 = re[b0],re[b1]
+                re[b0],re[b1] = x0+x1,x0-x1
+                x0,x1 = im[b0],im[b1]
+                im[b0],im[b1] = x0+x1,x0-x1
+
+
+def _walsh_hadamard_numpy(ket, num_qubits, qubits=None):
+    """
+    Returns the (unnormalized) Walsh-Hadamard transform of the given NumPy
+    statevector. If a list of qubits is given, the transform is only applied
+    to these.
+    """
+    if qubits is None:
+        qubits = range(num_qubits)
+    for j in qubits:
+        ket = ket.reshape(2**(num_qubits-j-1),2,2**j)
+        ket = np.stack((ket[:,0]+ket[:,1],ket[:,0]-ket[:,1]),axis=1)
+    return ket.reshape(2**num_qubits)
+
+
+class PartialXBlur():
+    """
+    Applies the blur effect of an rx rotation by pi*fraction on every qubit
+    (or a given set of them) to a circuit that encodes a height map, such
+    that it can be done efficiently for many different fractions.
+    
+    Since rx = H.rz.H, rotating every qubit is equivalent to a Walsh-Hadamard
+    transform, then a phase that depends only on the number of 1s in each
+    bit string, then another Walsh-Hadamard transform. The first transform is
+    done only once, when the object is created. Each fraction then costs one
+    diagonal multiplication and one O(n*2^n) transform.
+    
+    When only some qubits are rotated, such as for a blur along just one
+    axis (see `blur_qubits`), the transforms are only applied to those
+    qubits. For a horizontal blur, for example, each row is then transformed
+    independently.
+    
+    Args:
+        qc (QuantumCircuit): A circuit that contains only initialization,
+            such as those created by `height2circuit`. The name attribute
+            should hold the size of the image (as a tuple cast to a string).
+        axis (str): If 'x' or 'y', the blur is only along this axis.
+        qubits (list): The qubits to rotate, if not given by `axis`. By
+            default, these are as given by `circuit_blur_qubits` (and so
+            not those for the colour channel of circuits from
+            `image2circuit`).
+    """
+    def __init__(self, qc, axis=None, qubits=None):
+        
+        warning = "Circuits to blur should contain only initialization."
+        
+        ket = [1]+[0]*(2**qc.num_qubits-1)
+        for gate in qc.data:
+            if simple_python:
+                assert gate[0]=='init', warning
+                ket = gate[1]
+            else:
+                assert gate[0].name=='initialize', warning
+                ket = gate[0].params
+        
+        self.num_qubits = qc.num_qubits
+        try:
+            self.size = eval(qc.name)
+        except Exception:
+            self.size = None
+        if qubits is None:
+            qubits = circuit_blur_qubits(qc, axis)
+        self.qubits = list(qubits)
+        mask = sum([2**q for q in self.qubits])
+        
+        # the number of 1s in each bit string, counting only the rotated qubits
+        weights = [0]*(2**self.num_qubits)
+        for b in range(1,len(weights)):
+            weights[b] = weights[b>>1] + (b&1)
+        weights = [weights[b&mask] for b in range(len(weights))]
+        
+        # store the first transform of the initial state
+        if np is not None:
+            ket = np.array(ket,dtype=complex)
+            if ket.ndim==2:
+                ket = ket[:,0].real+1j*ket[:,1].real
+            self._ket = _walsh_hadamard_numpy(ket,self.num_qubits,self.qubits)
+            self._weights = np.array(weights)
+        else:
+            if type(ket[0])==list:
+                re = array('d',[amp[0] for amp in ket])
+                im = array('d',[amp[1] for amp in ket])
+            else:
+                re = array('d',[amp.real for amp in ket])
+                im = array('d',[amp.imag for amp in ket])
+            _walsh_hadamard(re,im,self.qubits)
+            self._ket = (re,im)
+            self._weights = weights
+    
+    def _phases(self, fraction):
+        """
+        Returns the phase (as a pair of real numbers) for each possible number
+        of 1s in a bit string, including the normalization of both transforms.
+        """
+        n = len(self.qubits)
+        theta = math.pi*fraction
+        phases = []
+        for w in range(n+1):
+            # rz(theta) applies exp(-i*theta/2) to each 0 and exp(i*theta/2) to each 1
+            angle = -theta*(n-2*w)/2
+            phases.append( (math.cos(angle)/2**n, math.sin(angle)/2**n) )
+        return phases
+    
+    def statevector(self, fraction):
+        """
+        Returns the real and imaginary parts of the blurred statevector for
+        the given fraction.
+        """
+        phases = self._phases(fraction)
+        if np is not None:
+            phases = np.array([c+1j*s for (c,s) in phases])
+            ket = _walsh_hadamard_numpy(self._ket*phases[self._weights],self.num_qubits,self.qubits)
+            return ket.real, ket.imag
+        else:
+            re,im = self._ket
+            new_re = array('d',re)
+            new_im = array('d',im)
+            for b,w in enumerate(self._weights):
+                c,s = phases[w]
+                new_re[b],new_im[b] = re[b]*c-im[b]*s, re[b]*s+im[b]*c
+            _walsh_hadamard(new_re,new_im,self.qubits)
+            return new_re, new_im
+    
+    def probabilities(self, fraction):
+        """
+        Returns the probabilities for the blurred state, in the same form as
+        `simulate(qc, get='probabilities')` for the blurred circuit.
+        """
+        re,im = self.statevector(fraction)
+        if np is not None:
+            return array('d',(re*re+im*im).tolist())
+        return array('d',[re[b]**2+im[b]**2 for b in range(len(re))])
+    
+    def probabilities_dict(self, fraction):
+        """
+        Returns the probabilities for the blurred state, in the same form as
+        `simulate(qc, get='probabilities_dict')` for the blurred circuit.
+        """
+        form = '{0:0'+str(self.num_qubits)+'b}'
+        return {form.format(b):p for b,p in enumerate(self.probabilities(fraction))}
+    
+    def height(self, fraction, log=False):
+        """
+        Returns the blurred height map for the given fraction.
+        
+        Args:
+            fraction (float): The blur is an rx rotation by pi*fraction on
+                each of the qubits.
+            log (bool): If given, a logarithmic decoding is used.
+        
+        Returns:
+            height (dict): A dictionary in which keys are coordinates
+                for points on a grid, and the values are floats in the
+                range 0 to 1.
+        """
+        return probs2height(self.probabilities(fraction), size=self.size, log=log)
+
+
+class BlurSession():
+    """
+    Keeps the blurred state for a height map, such that it can be updated
+    cheaply when only a few heights are changed (such as for a brush stroke
+    in a painting tool).
+    
+    The blur (an rx rotation by pi*fraction on every qubit) is linear in the
+    amplitudes of the encoded state. Changing the height at a single point
+    therefore changes the blurred state by a multiple of a single column of
+    the blur operator, which costs O(2^m) to add when m qubits are rotated.
+    The normalization of the state is tracked separately, and applied only
+    when the results are extracted.
+    
+    Args:
+        height (dict or HeightMap): A dictionary in which keys are
+            coordinates for points on a grid, and the values are positive
+            numbers of any type. Missing points are treated as zero.
+        fraction (float): The blur is an rx rotation by pi*fraction on
+            every qubit.
+        log (bool): If given, logarithmic encoding and decoding is used.
+        eps (float): As for `height2circuit`.
+        axis (str): If 'x' or 'y', the blur is only along this axis.
+    """
+    def __init__(self, height, fraction, log=False, eps=1e-4, axis=None):
+        if isinstance(height, HeightMap):
+            self.heights = HeightMap(height.Lx, height.Ly, height.data)
+        else:
+            self.heights = HeightMap.fromdict(height)
+        self.fraction = fraction
+        self.log = log
+        self.eps = eps
+        self.size = self.heights.size
+        self._pixel2basis, _, self.num_qubits = grid_tables(*self.size)
+        self.axis = axis
+        self.qubits = blur_qubits(self.size, axis)
+        # the bit strings that the rotated qubits can flip, along with the
+        # number of bits that they flip
+        flips = [0]
+        weights = [0]
+        for q in self.qubits:
+            flips += [b+2**q for b in flips]
+            weights += [w+1 for w in weights]
+        if np is not None:
+            self._flips = np.array(flips)
+            self._weights = np.array(weights)
+        else:
+            self._flips = flips
+            self._weights = weights
+        self.rebuild()
+    
+    def rebuild(self):
+        """
+        Recalculates the blurred state from scratch.
+        """
+        heights = self.heights.data
+        self._encoding = _encoding(heights, self.log, self.eps)
+        self._amplitudes = array('d',[_amplitude(h,self._encoding) for h in heights])
+        self._norm = sum([amp**2 for amp in self._amplitudes])
+        # the unnormalized state is blurred using the normalized one
+        qc = height2circuit(self.heights, log=self.log, eps=self.eps)
+        re,im = PartialXBlur(qc, qubits=self.qubits).statevector(self.fraction)
+        scale = math.sqrt(self._norm)
+        if np is not None:
+            self._ket = scale*(re+1j*im)
+        else:
+            self._ket = (array('d',[x*scale for x in re]), array('d',[x*scale for x in im]))
+    
+    def set_fraction(self, fraction):
+        """
+        Changes the amount of blur, which requires a full recalculation.
+        """
+        self.fraction = fraction
+        self.rebuild()
+    
+    def update(self, changes):
+        """
+        Changes the heights at the given points, and updates the blurred state
+        accordingly.
+        
+        Args:
+            changes (dict): New heights, with coordinates as keys.
+        """
+        Lx,Ly = self.size
+        data = self.heights.data
+        for (x,y) in changes:
+            self.heights[x,y] = changes[x,y]
+        
+        # the encoding of all points changes if the log encoding parameters do,
+        # and a full recalculation is faster when many points have changed
+        if len(changes)>=self.num_qubits:
+            self.rebuild()
+            return
+        if self.log and _encoding(data, self.log, self.eps)!=self._encoding:
+            self.rebuild()
+            return
+        
+        # the entries of the column of the blur for each number of flipped bits
+        n = len(self.qubits)
+        theta = math.pi*self.fraction
+        c, s = math.cos(theta/2), math.sin(theta/2)
+        column = [ (c**(n-d))*((-1j*s)**d) for d in range(n+1) ]
+        
+        for (x,y) in changes:
+            pixel = y*Lx+x
+            amp = _amplitude(data[pixel], self._encoding)
+            delta = amp - self._amplitudes[pixel]
+            if delta==0:
+                continue
+            self._norm += amp**2 - self._amplitudes[pixel]**2
+            self._amplitudes[pixel] = amp
+            j = self._pixel2basis[pixel]
+            if np is not None:
+                coefs = delta*np.array(column)
+                self._ket[self._flips^j] += coefs[self._weights]
+            else:
+                coefs = [(delta*z.real,delta*z.imag) for z in column]
+                re,im = self._ket
+                for (flip,w) in zip(self._flips,self._weights):
+                    cr,ci = coefs[w]
+                    re[flip^j] += cr
+                    im[flip^j] += ci
+    
+    def probabilities(self):
+        """
+        Returns the probabilities for the blurred state, in the same form as
+        `simulate(qc, get='probabilities')`.
+        """
+        if np is not None:
+            probs = (self._ket.real**2+self._ket.imag**2)/self._norm
+            return array('d',probs.tolist())
+        re,im = self._ket
+        return array('d',[(re[b]**2+im[b]**2)/self._norm for b in range(len(re))])
+    
+    def height(self, heightmap=False):
+        """
+        Returns the blurred height map.
+        
+        Args:
+            heightmap (bool): If given, a HeightMap is returned instead of a
+                dictionary.
+        """
+        return probs2height(self.probabilities(), size=self.size, log=self.log, heightmap=heightmap)
+
+
+def _circuit_ket(qc, warning):
+    """
+    Returns the statevector used to initialize a circuit that contains only
+    initialization, or None if there is no initialization.
+    """
+    ket = None
+    for gate in qc.data:
+        if simple_python:
+            assert gate[0]=='init', warning
+            ket = gate[1]
+        else:
+            assert gate[0].name=='initialize', warning
+            ket = gate[0].params
+    return ket
+
+
 def combine_circuits(qc0,qc1):
     """
     Combines a pair of initialization circuits in parallel
     Creates a single register circuit with the combined number of qubits,
     initialized with the tensor product state.s
+    
+    With MicroQiskit, the tensor product is stored as a `ProductState`, and
+    so is only calculated when the two registers become entangled.
     """
 
     warning = "Combined circuits should contain only initialization."
@@ -487,24 +1327,19 @@ def combine_circuits(qc0,qc1):
     combined_qc = QuantumCircuit(num_qubits)
 
     # extract statevectors for any initialization commands
-    kets = [None,None]
-    for j,qc in enumerate([qc0, qc1]):
-        for gate in qc.data:
-            if simple_python:
-                assert gate[0]=='init', warning
-                kets[j] = gate[1]
-            else:
-                assert gate[0].name=='initialize', warning
-                kets[j] = gate[0].params
+    kets = [_circuit_ket(qc, warning) for qc in [qc0, qc1]]
 
     # combine into a statevector for all the qubits
     ket = None
-    if kets[0] and kets[1]:
-        ket = _kron(kets[0], kets[1])
-    elif kets[0]:
-        ket = _kron(kets[0], [1]+[0]*(2**qc1.num_qubits-1))
-    elif kets[1]:
-        ket = _kron([1]+[0]*(2**qc0.num_qubits-1),kets[1])
+    if kets[0] or kets[1]:
+        if not kets[0]:
+            kets[0] = [1]+[0]*(2**qc0.num_qubits-1)
+        if not kets[1]:
+            kets[1] = [1]+[0]*(2**qc1.num_qubits-1)
+        if simple_python:
+            ket = ProductState(kets[0], kets[1])
+        else:
+            ket = _kron(kets[0], kets[1])
 
     # use this to initialize
     if ket:
@@ -519,21 +1354,39 @@ def combine_circuits(qc0,qc1):
     return combined_qc
 
 
-def partialswap(combined_qc, fraction):
+# the unitaries used by `partialswap`, for each fraction (with the cache cleared
+# once it holds `unitary_cache_size` of them)
+unitary_cache_size = 64
+_partialswap_unitaries = {}
+
+def _partialswap_unitary(fraction):
     """
-    Apply a partial swap to a given combined circuit (made up of two equal
-    sized circuits combined in parallel) by the given fraction.
+    Returns the unitary for the given fraction of a swap gate, as used by
+    `partialswap` with Qiskit. This is calculated only once for each
+    fraction.
     """
-    num_qubits = int(combined_qc.num_qubits/2)
-    
-    if not simple_python:
+    if fraction not in _partialswap_unitaries:
+        if len(_partialswap_unitaries)>=unitary_cache_size:
+            _partialswap_unitaries.clear()
         U = np.array([
         [1, 0, 0, 0],
         [0, 0, 1, 0],
         [0, 1, 0, 0],
         [0, 0, 0, 1]
         ])
-        U = fractional_matrix_power(U,fraction)
+        _partialswap_unitaries[fraction] = fractional_matrix_power(U,fraction)
+    return _partialswap_unitaries[fraction]
+
+
+def partialswap(combined_qc, fraction):
+    """
+    Apply a partial swap to a given combined circuit (made up of two equal
+    sized circuits combined in parallel) by the given fraction.
+    """
+    num_qubits = int(combined_qc.num_qubits/2)
+    
+    if not simple_python:
+        U = _partialswap_unitary(fraction)
     for q in range(num_qubits):
         q0 = q
         q1 = num_qubits + q
@@ -541,21 +1394,38 @@ def partialswap(combined_qc, fraction):
             combined_qc.unitary(U, [q0,q1],\
                                  label='partial_swap')
         else:
-            combined_qc.cx(q1,q0)
-            combined_qc.crx(math.pi*fraction,q0,q1)
-            combined_qc.cx(q1,q0) 
+            # equivalent to cx(q1,q0), crx(pi*fraction,q0,q1), cx(q1,q0)
+            combined_qc.pswap(fraction,q0,q1)
 
             
-#def probs2marginals(combined_qc, probs):
 def probs2marginals(num_qubits, probs):
     """
     Given a probability distribution corresponding to a given combined
     circuit (made up of two equal sized circuits combined in parallel),
     this function returns the two marginals for each subcircuit.
+    
+    The probabilities can be a dictionary with bit strings as keys, in
+    which case the marginals are too. Otherwise they can be a flat list or
+    array indexed by the integers that the bit strings represent, in which
+    case the marginals are flat arrays.
     """
     #num_qubits = int(combined_qc.num_qubits/2)
+    total_qubits = num_qubits
     num_qubits = int(num_qubits/2)
     
+    if not isinstance(probs, dict):
+        # the first marginal is for the highest bits, which come first in the bit strings
+        low_qubits = total_qubits - num_qubits
+        if np is not None:
+            p = np.asarray(probs).reshape(2**num_qubits,2**low_qubits)
+            return [array('d',p.sum(axis=1).tolist()), array('d',p.sum(axis=0).tolist())]
+        marginals = [array('d',[0.0])*2**num_qubits, array('d',[0.0])*2**low_qubits]
+        mask = 2**low_qubits-1
+        for j,p in enumerate(probs):
+            marginals[0][j>>low_qubits] += p
+            marginals[1][j&mask] += p
+        return marginals
+    
     marginals = [{},{}]
     for string in probs:
         substrings = [string[0:num_qubits], string[num_qubits::]]
@@ -567,6 +1437,33 @@ def probs2marginals(num_qubits, probs):
     
     return marginals
     
+def circuit2marginals(combined_qc):
+    """
+    Simulates a combined circuit (made up of two equal sized circuits
+    combined in parallel), and returns the two marginals for each
+    subcircuit as flat arrays.
+    
+    If the circuit was created by `combine_circuits` and no gates act on
+    qubits in both registers, the marginals are calculated for each register
+    separately, without the full statevector. Otherwise the full statevector
+    from the same simulation is used.
+    """
+    if simple_python:
+        data = combined_qc.data
+        if data and data[0][0]=='init' and isinstance(data[0][1],ProductState):
+            state = evolve_factors(combined_qc)
+            if len(state.factors)==2 and len(state.factors[0])==len(state.factors[1]):
+                return [array('d',[abs(amp)**2 for amp in factor]) for factor in state.factors]
+            if np is not None:
+                ket = state._expand_numpy()
+                probs = ket.real**2 + ket.imag**2
+            else:
+                probs = [abs(amp)**2 for amp in state.expand()]
+            return probs2marginals(combined_qc.num_qubits, probs)
+    probs = _circuit2probs(combined_qc, flat=True)
+    return probs2marginals(combined_qc.num_qubits, probs)
+    
+    
 # def probs2marginalsnocircuit(num_qubits, probs):
     # """
     # Given a probability distribution corresponding to a given combined
@@ -586,40 +1483,253 @@ def probs2marginals(num_qubits, probs):
     # return marginals
 
 
+# maximum number of amplitudes processed at once by `swap_marginals`
+swap_chunk_size = 2**16
+
+def _swap_block(fraction):
+    """
+    Returns the diagonal and off-diagonal elements of the partial swap
+    applied by `partialswap`, on the subspace where the two qubits differ.
+    The partial swap acts trivially when they are the same.
+    """
+    if simple_python:
+        # the effect of the cx, crx, cx decomposition
+        theta = math.pi*fraction
+        return complex(math.cos(theta/2),0), complex(0,-math.sin(theta/2))
+    else:
+        # the fractional power of the swap matrix
+        U = _partialswap_unitary(fraction)
+        return complex(U[1][1]), complex(U[1][2])
+
+
+def _ket_parts(ket):
+    """
+    Returns the real and imaginary parts of a statevector, as two
+    `array('d')` buffers.
+    """
+    if type(ket[0])==list:
+        return array('d',[amp[0] for amp in ket]), array('d',[amp[1] for amp in ket])
+    else:
+        return array('d',[complex(amp).real for amp in ket]), array('d',[complex(amp).imag for amp in ket])
+
+
+def swap_marginals(ket0, ket1, fraction, chunk_size=None):
+    """
+    Calculates the marginal probabilities for each register after the
+    partial swaps of `partialswap` are applied to the tensor product of two
+    equal sized statevectors.
+    
+    This gives the same results as creating a circuit with `combine_circuits`
+    and `partialswap`, simulating it and then using `probs2marginals`. But
+    the combined statevector is stored only once, in place, and it is
+    processed in chunks of at most `chunk_size` amplitudes. The temporary
+    memory required is then a small multiple of this, rather than of the
+    size of the combined statevector. No bit strings are created.
+    
+    Args:
+        ket0, ket1 (list): Statevectors, such as those used to initialize
+            the circuits created by `height2circuit`.
+        fraction (float): Fraction of swap gates to apply.
+        chunk_size (int): Maximum number of amplitudes to process at once.
+            If not given, `swap_chunk_size` is used.
+            
+    Returns:
+        marginals (list): The marginal probabilities for each register, as
+            flat arrays.
+    """
+    return swap_marginals_batch([ket0], [ket1], fraction, chunk_size)[0]
+
+
+def swap_marginals_batch(kets0, kets1, fraction, chunk_size=None):
+    """
+    A version of `swap_marginals` for a batch of pairs of statevectors (such
+    as those for each colour channel of a pair of images). These are
+    processed together in groups, for which the combined statevectors
+    have at most `chunk_size` amplitudes in total (with a single pair
+    per group if each is larger than this). The memory required is then
+    bounded, however large the batch.
+    
+    Args:
+        kets0, kets1 (list): Lists of statevectors, all of the same size.
+            The first of `kets0` is swapped with the first of `kets1`, and
+            so on.
+        fraction (float): Fraction of swap gates to apply.
+        chunk_size (int): Maximum number of amplitudes to process at once.
+            If not given, `swap_chunk_size` is used.
+            
+    Returns:
+        marginals (list): The pair of marginals for each pair of
+            statevectors.
+    """
+    B = len(kets0)
+    N = len(kets0[0])
+    assert len(kets1)==B, "Batches to be swapped are not the same size"
+    for ket in kets0+kets1:
+        assert len(ket)==N, "Statevectors to be swapped are not the same size"
+    n = int(round(math.log(N)/math.log(2)))
+    if not chunk_size:
+        chunk_size = swap_chunk_size
+    
+    # split the batch into groups, which are processed one after another
+    group = max(1, chunk_size//(N*N))
+    if B>group:
+        marginals = []
+        for b in range(0,B,group):
+            marginals += swap_marginals_batch(kets0[b:b+group], kets1[b:b+group], fraction, chunk_size)
+        return marginals
+    
+    diag, off = _swap_block(fraction)
+    
+    # the combined statevectors are indexed by [b*N+j0,j1] for the index j0
+    # of ket0 and j1 of ket1 for the pair b, such that ket0 is on the highest
+    # qubits
+    rows = max(1,min(N,chunk_size//N))
+    if np is not None:
+        
+        def to_numpy(ket):
+            ket = np.array(ket,dtype=complex)
+            if ket.ndim==2:
+                ket = ket[:,0].real+1j*ket[:,1].real
+            return ket
+        
+        ket = np.empty((B*N,N),dtype=complex)
+        for b in range(B):
+            ket0 = to_numpy(kets0[b])
+            ket1 = to_numpy(kets1[b])
+            for j in range(0,N,rows):
+                ket[b*N+j:b*N+j+rows] = np.outer(ket0[j:j+rows],ket1)
+        
+        # each partial swap mixes the amplitudes for which the qubit is 0 in
+        # one register and 1 in the other
+        for q in range(n):
+            A = 2**(n-q-1)
+            Q = 2**q
+            view = ket.reshape(B*A,2,Q,A,2,Q)
+            step = max(1,chunk_size//(A*Q))
+            for a in range(B*A):
+                for j in range(0,Q,step):
+                    x = view[a,0,j:j+step,:,1,:]
+                    y = view[a,1,j:j+step,:,0,:]
+                    new_x = diag*x + off*y
+                    y *= diag
+                    y += off*x
+                    x[...] = new_x
+        
+        marginals = []
+        for b in range(B):
+            pair = [np.zeros(N),np.zeros(N)]
+            for j in range(0,N,rows):
+                block = ket[b*N+j:b*N+j+rows]
+                probs = block.real**2 + block.imag**2
+                pair[0][j:j+rows] = probs.sum(axis=1)
+                pair[1] += probs.sum(axis=0)
+            marginals.append([array('d',marginal.tolist()) for marginal in pair])
+        return marginals
+    
+    else:
+        
+        re = array('d',[0.0])*(B*N*N)
+        im = array('d',[0.0])*(B*N*N)
+        for b in range(B):
+            re0,im0 = _ket_parts(kets0[b])
+            re1,im1 = _ket_parts(kets1[b])
+            for j0 in range(N):
+                r0,i0 = re0[j0],im0[j0]
+                k = (b*N+j0)*N
+                re[k:k+N] = array('d',[r0*r1-i0*i1 for r1,i1 in zip(re1,im1)])
+                im[k:k+N] = array('d',[r0*i1+i0*r1 for r1,i1 in zip(re1,im1)])
+        
+        dr,di = diag.real,diag.imag
+        orr,oi = off.real,off.imag
+        for q in range(n):
+            bit = 2**q
+            for j0 in range(B*N):
+                if j0&bit:
+                    continue
+                base0 = j0*N
+                base1 = (j0+bit)*N - bit
+                for j1 in range(bit,N,2*bit):
+                    for k in range(base0+j1,base0+j1+bit):
+                        l = base1+k-base0
+                        xr,xi = re[k],im[k]
+                        yr,yi = re[l],im[l]
+                        re[k] = dr*xr-di*xi + orr*yr-oi*yi
+                        im[k] = dr*xi+di*xr + orr*yi+oi*yr
+                        re[l] = orr*xr-oi*xi + dr*yr-di*yi
+                        im[l] = orr*xi+oi*xr + dr*yi+di*yr
+        
+        marginals = []
+        for b in range(B):
+            pair = [array('d',[0.0])*N,array('d',[0.0])*N]
+            for j0 in range(N):
+                total = 0.0
+                for j1 in range(N):
+                    k = (b*N+j0)*N+j1
+                    p = re[k]**2+im[k]**2
+                    total += p
+                    pair[1][j1] += p
+                pair[0][j0] = total
+            marginals.append(pair)
+        return marginals
+
+
 def swap_heights(height0, height1, fraction, log=False, ):
     """
     Given a pair of height maps for the same sized grid, a set of partial
     swaps is applied between corresponding qubits in each circuit.
     
     Args:
-        height0, height1 (dict): Dictionaries in which keys are coordinates
-            for points on a grid, and the values are floats in the range 0
-            to 1.
+        height0, height1 (dict or HeightMap): Dictionaries in which keys
+            are coordinates for points on a grid, and the values are floats
+            in the range 0 to 1.
         fraction (float): Fraction of swap gates to apply.
         log (bool): If given, a logarithmic decoding is used.
             
     Returns:
-        new_height0, new_height1 (dict): As with the height inputs.
+        new_height0, new_height1 (dict or HeightMap): As with the height
+            inputs.
     """
 
-    assert _get_size(height0)==_get_size(height1), \
-    "Objects to be swapped are not the same size"   
+    new_heights0, new_heights1 = swap_heights_batch([height0], [height1], fraction, log=log)
+        
+    return new_heights0[0], new_heights1[0]
+
+
+def swap_heights_batch(heights0, heights1, fraction, log=False):
+    """
+    A version of `swap_heights` for a batch of pairs of height maps (such
+    as those for each colour channel of a pair of images), which are all
+    processed together.
     
-    # set up the circuit to be run
-    circuits = [height2circuit(height) for height in [height0,height1]]
-    combined_qc = combine_circuits(circuits[0], circuits[1])
+    Args:
+        heights0, heights1 (list): Lists of height maps, all for the same
+            size of grid. The first of `heights0` is swapped with the first
+            of `heights1`, and so on.
+        fraction (float): Fraction of swap gates to apply.
+        log (bool): If given, a logarithmic decoding is used.
+            
+    Returns:
+        new_heights0, new_heights1 (list): As with the height inputs.
+    """
     
+    size = _get_size(heights0[0])
+    for height in heights0+heights1:
+        assert _get_size(height)==size, \
+        "Objects to be swapped are not the same size"   
     
-    partialswap(combined_qc, fraction)
+    # encode the heights
+    kets = [[_circuit_ket(height2circuit(height), '') for height in heights]\
+            for heights in [heights0,heights1]]
     
-    # run it an get the marginals for each original qubit register
-    p = _circuit2probs(combined_qc)           
-    marginals = probs2marginals(combined_qc.num_qubits, p)     
+    # get the marginals for each original qubit register after the swaps
+    marginals = swap_marginals_batch(kets[0], kets[1], fraction)
     
     # convert the marginals to heights
-    new_heights = []
-    for j,marginal in enumerate(marginals):
-        new_heights.append( probs2height(marginal,size=eval(circuits[j].name),log=log) )
+    new_heights = [[],[]]
+    for b,pair in enumerate(marginals):
+        for j,marginal in enumerate(pair):
+            heightmap = isinstance([heights0,heights1][j][b],HeightMap)
+            new_heights[j].append( probs2height(marginal,size=size,log=log,heightmap=heightmap) )
         
     return new_heights[0], new_heights[1]
 
@@ -650,6 +1760,9 @@ def swap_heights2circuit(height0, height1, fraction, log=False, normalizeManuall
     circuit1=height2circuit(height1, False, normalizeManually)
     
     combined_qc = combine_circuits(circuit0, circuit1)    
+    if simple_python:
+        # the full statevector is needed when the circuit is used by Unity
+        combined_qc.initialize(_circuit_ket(combined_qc, '').expand())
     
     partialswap(combined_qc, fraction)
     combined_qc.name=circuit0.name
@@ -664,9 +1777,9 @@ def height2image(height):
     an image.
 
     Args:
-        height (dict): A dictionary in which keys are coordinates
-                for points on a grid, and the values are positive
-                numbers of any type.
+        height (dict or HeightMap): A dictionary in which keys are
+                coordinates for points on a grid, and the values are
+                positive numbers of any type.
 
     Returns:
         image (Image): Monochrome image for which the given height
@@ -674,16 +1787,9 @@ def height2image(height):
             maximum value in the height dictionary is always white.
     """
     Lx,Ly = _get_size(height)
-    h_max = max(height.values())
 
     image = newimage('L',(Lx,Ly))
-    for x in range(Lx):
-        for y in range(Ly):
-            if (x,y) in height:
-                h = float(height[x,y])/h_max
-            else:
-                h = 0
-            image.putpixel((x,y), int(255*h) )
+    image.frombytes(bytes(_height2bytes(height, Lx, Ly)))
 
     return image
 
@@ -704,12 +1810,8 @@ def swap_images(image0, image1, fraction, log=False):
     heights0 = _image2heights(image0)
     heights1 = _image2heights(image1)
 
-    new_heights0 = []
-    new_heights1 = []
-    for j in range(3):
-        nh0, nh1 = swap_heights(heights0[j], heights1[j], fraction, log=log)
-        new_heights0.append(nh0)
-        new_heights1.append(nh1)
+    # all colour channels are swapped together
+    new_heights0, new_heights1 = swap_heights_batch(heights0, heights1, fraction, log=log)
 
     new_image0 = _heights2image(new_heights0)
     new_image1 = _heights2image(new_heights1)
@@ -750,9 +1852,87 @@ def circuits2image(circuits, log=False):
         image (Image): An RGB encoded image.
     """
 
+    heights = circuits2heights(circuits, log=log)
+
+    return _heights2image(heights)
+
+
+def image2circuit(image, log=False, eps=1e-4):
+    """
+    Converts an image to a single circuit, as an alternative to
+    `image2circuits`. The qubits for the grid are as for `height2circuit`,
+    and two more qubits (the highest) select the colour channel. The
+    statevector for each channel is then a block of the full statevector,
+    and they all have the same weight.
+    
+    Since `blur_qubits` and `PartialXBlur` do not rotate the channel qubits,
+    blurring this circuit gives the same results as blurring the circuit for
+    each channel, but with just one simulation.
+
+    Args:
+        image (Image): An RGB (or RGBA) encoded image.
+        log (bool): If given, a logarithmic encoding is used.
+
+    Returns:
+        qc (QuantumCircuit): A quantum circuit encoding the image.
+    """
+
+    heights = _image2heights(image)
+    Lx,Ly = image.size
+    pixel2basis, _, n = grid_tables(Lx,Ly)
+    N = 2**n
+
+    state = [0]*(N*2**channel_qubits)
+    for c,height in enumerate(heights):
+        # a channel that is zero everywhere is left as an empty block
+        if not any(height.data):
+            continue
+        encoding = _encoding(height.data, log, eps)
+        block = [0]*N
+        for (j,h) in zip(pixel2basis,height.data):
+            block[j] = _amplitude(h, encoding)
+        if any(block):
+            state[c*N:(c+1)*N] = normalize(block)
+    state = normalize(state)
+
+    qc = QuantumCircuit(n+channel_qubits)
+    if simple_python:
+        qc.initialize(state)
+    else:
+        qc.initialize(state,range(n+channel_qubits))
+    qc.name = '('+str(Lx)+','+str(Ly)+')'
+
+    return qc
+
+
+def circuit2image(qc, log=False):
+    """
+    Extracts an image from a circuit created by `image2circuit`. An RGBA
+    image is created only if the block for the alpha channel is not empty.
+    Any other empty block (such as for a channel that is zero everywhere)
+    gives zero heights for its channel.
+
+    Args:
+        qc (QuantumCircuit): A quantum circuit encoding the image.
+        log (bool): If given, a logarithmic decoding is used.
+
+    Returns:
+        image (Image): An RGB (or RGBA) encoded image.
+    """
+
+    size = eval(qc.name)
+    N = 2**(qc.num_qubits-channel_qubits)
+    probs = _circuit2probs(qc, flat=True)
+
+    blocks = [probs[c*N:(c+1)*N] for c in range(2**channel_qubits)]
+    if not any(blocks[3]):
+        blocks = blocks[:3]
     heights = []
-    for qc in circuits:
-        heights.append( circuit2height(qc, log=log) )
+    for block in blocks:
+        if any(block):
+            heights.append(probs2height(block, size=size, log=log, heightmap=True))
+        else:
+            heights.append(HeightMap(*size))
 
     return _heights2image(heights)
 
@@ -772,28 +1952,359 @@ def row_swap_images(image0, image1, fraction, log=False):
     Returns:
         new_image0, new_image1 (Image): RGB encoded images.
     """
-    images = [image0, image1]
+    Lx,Ly = image0.size
 
-    Lx,Ly = images[0].size
+    return swap_image_tiles(image0, image1, fraction, (Lx,1), log=log)
 
-    # create separate images for each row
-    rows = [[],[]]
-    for j in range(2):
-        for y in range(Ly):   
-            rows[j].append(newimage('RGB',(Lx,1)))
-            for x in range(Lx):
-                rows[j][y].putpixel((x,0),images[j].getpixel((x,y)))
 
+def _image_tiles(Lx, Ly, size):
+    """
+    Returns the tiles (x0,y0,w,h) of the given size that cover an Lx by Ly
+    image without overlapping, with smaller tiles at the edges if needed.
+    """
+    (tx,ty) = size
+    return [(x0,y0,min(tx,Lx-x0),min(ty,Ly-y0)) for y0 in range(0,Ly,ty) for x0 in range(0,Lx,tx)]
 
-    # do the swap on the row images
-    for y in range(Ly):
-        rows[0][y], rows[1][y] = swap_images(rows[0][y], rows[1][y], fraction, log=log)
 
-    # reconstruct the full images
-    new_images = [newimage('RGB',(Lx,Ly)) for _ in range(2)]
+def swap_image_tiles(image0, image1, fraction, size, log=False, workers=None):
+    """
+    A variant of `swap_images` in which the swap process is done on each
+    rectangular tile of the images individually, as for `row_swap_images`
+    (which uses tiles that are each a whole row).
+    
+    The tiles and colour channels are swapped together with
+    `swap_heights_batch`, in batches of tiles of the same size that are
+    each limited to `swap_chunk_size` amplitudes in total (and shared
+    between the worker threads, if there are more than one). The results
+    are written directly into the pixel buffer of each new image.
+    
+    Args:
+        image0, image1 (Image): RGB (or RGBA) encoded images.
+        fraction (float): Fraction of swap gates to apply.
+        size (tuple): Width and height of the tiles. Tiles at the right and
+            bottom edges are smaller if the images are not a whole number of
+            tiles wide and high.
+        log (bool): If given, a logarithmic decoding is used.
+        workers (int): Number of threads to use. If not given, this is as
+            for the 'array' engine of MicroQiskit.
+            
+    Returns:
+        new_image0, new_image1 (Image): RGB (or RGBA) encoded images.
+    """
+    assert image0.size==image1.size, "Images to be swapped are not the same size"
+    Lx,Ly = image0.size
+    bands = _image_bands.get(image0.mode,3)
+    pixels = [bytearray(image.tobytes()) for image in [image0,image1]]
+    new_pixels = [bytearray(bands*Lx*Ly) for _ in range(2)]
+
+    def swap(tiles):
+        # get height maps for each colour channel of each tile
+        heights = [[],[]]
+        for j in range(2):
+            for (x0,y0,w,h) in tiles:
+                for c in range(bands):
+                    data = []
+                    for y in range(y0,y0+h):
+                        start = (y*Lx+x0)*bands+c
+                        data += pixels[j][start:start+w*bands:bands]
+                    heights[j].append( HeightMap(w,h,data) )
+        # swap them all together
+        new_heights = swap_heights_batch(heights[0], heights[1], fraction, log=log)
+        # write the results into the new images
+        for j in range(2):
+            for t,(x0,y0,w,h) in enumerate(tiles):
+                for c in range(bands):
+                    tile_pixels = _height2bytes(new_heights[j][t*bands+c], w, h)
+                    for y in range(h):
+                        start = ((y0+y)*Lx+x0)*bands+c
+                        new_pixels[j][start:start+w*bands:bands] = tile_pixels[y*w:(y+1)*w]
+
+    # group the tiles by size, and split each group between the workers in
+    # batches for which the combined statevectors have at most
+    # `swap_chunk_size` amplitudes in total
+    groups = {}
+    for tile in _image_tiles(Lx, Ly, size):
+        groups.setdefault(tile[2:], []).append(tile)
+    if workers is None:
+        workers = _thread_count()
+    batches = []
+    for (w,h),tiles in groups.items():
+        N = 2**grid_tables(w,h)[2]
+        step = min(-(-len(tiles)//workers), max(1, swap_chunk_size//(N*N*bands)))
+        batches += [tiles[k:k+step] for k in range(0,len(tiles),step)]
+    _run_tiles(iter(batches), swap, workers)
+
+    new_images = []
     for j in range(2):
-        for y in range(Ly):
-            for x in range(Lx):
-                new_images[j].putpixel((x,y),rows[j][y].getpixel((x,0)))
+        new_images.append(newimage('RGBA' if bands==4 else 'RGB',(Lx,Ly)))
+        new_images[j].frombytes(bytes(new_pixels[j]))
+
+    return new_images[0], new_images[1]
+
+# default size of the tiles used by `tiled_blur` and `tiled_swap_heights`, and
+# the number of points by which neighbouring tiles overlap
+tile_size = 8
+tile_overlap = 2
+
+def _tile_starts(L, size, overlap):
+    """
+    Returns the starting points of tiles of the given size that cover a line
+    of length L, overlapping by (at least) the given amount, along with the
+    size of the tiles (which is reduced if larger than L).
+    """
+    size = min(size, L)
+    step = max(1, size-overlap)
+    starts = list(range(0, L-size+1, step))
+    if starts[-1]+size < L:
+        starts.append(L-size)
+    return starts, size
+
+
+def tile_grid(Lx, Ly, size=None, overlap=None):
+    """
+    Returns the tiles used to cover an Lx by Ly grid.
+    
+    Args:
+        Lx, Ly (int): Width and height of the grid.
+        size (int or tuple): Width and height of the tiles, or a single
+            number for square tiles. If not given, `tile_size` is used.
+        overlap (int): Number of points by which neighbouring tiles overlap.
+            If not given, `tile_overlap` is used.
+    
+    Returns:
+        tiles (list): The position (x0,y0) of the corner and the width and
+            height for each tile, as a tuple (x0,y0,w,h).
+    """
+    if size is None:
+        size = tile_size
+    if overlap is None:
+        overlap = tile_overlap
+    if not isinstance(size, tuple):
+        size = (size,size)
+    xs, w = _tile_starts(Lx, size[0], overlap)
+    ys, h = _tile_starts(Ly, size[1], overlap)
+    return [(x0,y0,w,h) for y0 in ys for x0 in xs]
+
+
+def _seam_weights(start, size, L, overlap):
+    """
+    Returns the weight of each point along one side of a tile, when blending
+    it with its neighbours. These ramp up linearly over the overlap on each
+    side that meets another tile, and are 1 elsewhere.
+    """
+    ramp = float(overlap+1)
+    weights = [1.0]*size
+    for i in range(size):
+        if start>0:
+            weights[i] = min(weights[i], (i+1)/ramp)
+        if start+size<L:
+            weights[i] = min(weights[i], (size-i)/ramp)
+    return weights
+
+
+class _TiledHeights():
+    """
+    Accumulates the results for each tile of an Lx by Ly grid, blending
+    them where they overlap. Tiles can be added from any thread.
+    """
+    def __init__(self, Lx, Ly, overlap):
+        self.Lx = Lx
+        self.Ly = Ly
+        self.overlap = overlap
+        self.values = array('d',[0.0])*(Lx*Ly)
+        self.weights = array('d',[0.0])*(Lx*Ly)
+        self.lock = threading.Lock()
+    
+    def add(self, tile, heights):
+        """
+        Adds the flat list of heights (row by row) for the given tile.
+        """
+        (x0,y0,w,h) = tile
+        wx = _seam_weights(x0, w, self.Lx, self.overlap)
+        wy = _seam_weights(y0, h, self.Ly, self.overlap)
+        with self.lock:
+            for y in range(h):
+                row = (y0+y)*self.Lx+x0
+                for x in range(w):
+                    weight = wx[x]*wy[y]
+                    self.values[row+x] += weight*heights[y*w+x]
+                    self.weights[row+x] += weight
+    
+    def height(self, heightmap):
+        """
+        Returns the blended heights, rescaled such that the maximum is 1.
+        The heights are normalized in place, so this should be called only
+        once all tiles have been added, and only once.
+        """
+        values = self.values
+        for j,wt in enumerate(self.weights):
+            values[j] /= wt
+        max_h = max(values)
+        if max_h>0:
+            for j in range(len(values)):
+                values[j] /= max_h
+        if heightmap:
+            height = HeightMap(self.Lx, self.Ly)
+            height.data = values
+            return height
+        Lx = self.Lx
+        return {(x,y):values[y*Lx+x] for y in range(self.Ly) for x in range(Lx)}
+
+
+def _tile_heights(height, tile):
+    """
+    Returns the flat list of heights (row by row) for the given tile of a
+    HeightMap.
+    """
+    (x0,y0,w,h) = tile
+    heights = []
+    for y in range(y0,y0+h):
+        heights += height.data[y*height.Lx+x0:y*height.Lx+x0+w]
+    return heights
+
+
+def _run_tiles(tiles, process, workers=None):
+    """
+    Calls `process` for each of the given tiles. If more than one worker
+    thread is used, the tiles are taken a few at a time for each worker,
+    so that the number in progress (and the memory they require) is
+    bounded. The tiles can therefore be given by a generator.
+    
+    The tiles use their own worker pool, since processing them can run
+    simulations that themselves use the simulation pool.
+    """
+    if workers is None:
+        workers = _thread_count()
+    if workers<=1:
+        for tile in tiles:
+            process(tile)
+        return
+    
+    def task(tile):
+        return lambda: process(tile)
+    
+    pool = _worker_pool(workers, 'tiles')
+    group = []
+    for tile in tiles:
+        group.append(task(tile))
+        if len(group)==4*workers:
+            pool.run(group)
+            group = []
+    if group:
+        pool.run(group)
+
+
+def tiled_blur(height, fraction, size=None, overlap=None, log=False, axis=None, workers=None):
+    """
+    Applies the blur of `PartialXBlur` to each tile of a height map
+    separately, and blends the results where tiles overlap. Each tile needs
+    only as many qubits as its own size requires, so large height maps can
+    be blurred with little memory.
+    
+    The blurred heights of each tile are scaled by its total height (or
+    maximum height, for the logarithmic encoding) so that the brightness
+    of tiles is consistent.
+    
+    Args:
+        height (dict or HeightMap): A height map.
+        fraction (float): The blur is an rx rotation by pi*fraction on
+            each of the qubits for each tile.
+        size (int or tuple): Size of the tiles, as for `tile_grid`.
+        overlap (int): Overlap of the tiles, as for `tile_grid`.
+        log (bool): If given, a logarithmic encoding is used.
+        axis (str): If 'x' or 'y', the blur is only along this axis.
+        workers (int): Number of threads used to process tiles. If not
+            given, this is as for the 'array' engine of MicroQiskit.
+    
+    Returns:
+        height (dict or HeightMap): The blurred heights, of the same type
+            as the input.
+    """
+    heightmap = isinstance(height, HeightMap)
+    if not heightmap:
+        height = HeightMap.fromdict(height)
+    if overlap is None:
+        overlap = tile_overlap
+    output = _TiledHeights(height.Lx, height.Ly, overlap)
+    
+    def process(tile):
+        heights = _tile_heights(height, tile)
+        (_,_,w,h) = tile
+        if max(heights)<=0:
+            output.add(tile, heights)
+            return
+        qc = height2circuit(HeightMap(w,h,heights), log=log)
+        probs = PartialXBlur(qc, axis=axis).probabilities(fraction)
+        blurred = probs2height(probs, size=(w,h), log=log, heightmap=True).data
+        if log:
+            scale = max(heights)
+        else:
+            scale = max(probs)*sum(heights)
+        output.add(tile, [scale*b for b in blurred])
+    
+    _run_tiles(iter(tile_grid(height.Lx, height.Ly, size, overlap)), process, workers)
+    
+    return output.height(heightmap)
 
-    return new_images[0], new_images[1]
\ No newline at end of file
+
+def tiled_swap_heights(height0, height1, fraction, size=None, overlap=None, log=False, workers=None):
+    """
+    Applies the partial swaps of `swap_heights` to each pair of
+    corresponding tiles of two height maps separately, and blends the
+    results where tiles overlap.
+    
+    The heights of each tile are scaled by the total height (or maximum
+    height, for the logarithmic encoding) expected after the swap. This is
+    interpolated between those of the two tiles, with the same weights as
+    the partial swap gives to their amplitudes.
+    
+    Args:
+        height0, height1 (dict or HeightMap): Height maps of the same size.
+        fraction (float): Fraction of swap gates to apply.
+        size (int or tuple): Size of the tiles, as for `tile_grid`.
+        overlap (int): Overlap of the tiles, as for `tile_grid`.
+        log (bool): If given, a logarithmic decoding is used.
+        workers (int): Number of threads used to process tiles. If not
+            given, this is as for the 'array' engine of MicroQiskit.
+    
+    Returns:
+        new_height0, new_height1 (dict or HeightMap): The swapped heights,
+            of the same type as the inputs.
+    """
+    assert _get_size(height0)==_get_size(height1), \
+    "Objects to be swapped are not the same size"
+    heightmap = isinstance(height0, HeightMap)
+    heights = [h if isinstance(h, HeightMap) else HeightMap.fromdict(h) for h in [height0,height1]]
+    if overlap is None:
+        overlap = tile_overlap
+    (Lx,Ly) = heights[0].size
+    outputs = [_TiledHeights(Lx, Ly, overlap) for _ in range(2)]
+    
+    # the fraction of each tile's amplitudes that are swapped
+    swapped = math.sin(math.pi*fraction/2)**2
+    
+    def process(tile):
+        (_,_,w,h) = tile
+        tiles = [_tile_heights(height, tile) for height in heights]
+        kets = []
+        for tile_heights in tiles:
+            if max(tile_heights)<=0:
+                # empty tiles are replaced by a uniform state, with no height
+                tile_heights = [1.0]*len(tile_heights)
+            # as for `swap_heights`, the logarithmic encoding is used only for decoding
+            kets.append(_circuit_ket(height2circuit(HeightMap(w,h,tile_heights)), ''))
+        marginals = swap_marginals(kets[0], kets[1], fraction)
+        if log:
+            scales = [max(tile_heights) for tile_heights in tiles]
+        else:
+            scales = [sum(tile_heights) for tile_heights in tiles]
+        for j in range(2):
+            scale = (1-swapped)*scales[j] + swapped*scales[1-j]
+            swapped_heights = probs2height(marginals[j], size=(w,h), log=log, heightmap=True).data
+            if not log:
+                scale *= max(marginals[j])
+            outputs[j].add(tile, [scale*s for s in swapped_heights])
+    
+    _run_tiles(iter(tile_grid(Lx, Ly, size, overlap)), process, workers)
+    
+    return outputs[0].height(heightmap), outputs[1].height(heightmap)
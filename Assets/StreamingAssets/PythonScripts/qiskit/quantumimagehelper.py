@@ -18,22 +18,54 @@ import time
 
 #Static stuff
 
-def HeightMapFromHeight(height, x, y,):
-    heightMap= {}
+def HeightArrayFromHeight(height, x, y):
+    # converts a height[x,y] array to a flat row-major buffer
+    heights = array('d',[0.0])*(x*y)
+    if hasattr(height, 'Rank'):
+        # a .NET double[x,y] is copied in one go, with the y index running
+        # fastest, so each row is every y-th element of the copy
+        columns = array('d', height)
+        for j in range(y):
+            heights[j*x:(j+1)*x] = columns[j::y]
+        return heights
     for i in range(x):
         for j in range(y):
-            heightMap[i,j] = height[i,j] 
+            heights[j*x+i] = height[i,j]
+    return heights
+
+def HeightMapFromHeight(height, x, y,):
+    heightMap= HeightMap(x, y)
+    heightMap.data = HeightArrayFromHeight(height, x, y)
     return heightMap
 
 def CircuitFromHeight(height, x, y, log=False):
-    heightMap= {}
-    for i in range(x):
-        for j in range(y):
-            heightMap[i,j] = height[i,j]        
+    return CircuitFromHeightArray(HeightArrayFromHeight(height, x, y), x, y, log)
+
+
+# Bulk versions, which take and return flat row-major buffers (with the height
+# for (x,y) at y*width+x) instead of dictionaries, and integer sizes instead of
+# dimension strings
+
+def CircuitFromHeightArray(heights, width, height, log=False):
+    heightMap = HeightMap(width, height, heights)
+    return height2circuit(heightMap, log)
+
 
-    qc = height2circuit(heightMap, log)
+def HeightArrayFromProbabilities(probabilities, width, height, log=False):
+    # element j of the probabilities is for the bit string that represents j
+    heightMap = probs2height(probabilities, (width, height), log, heightmap=True)
+    return heightMap.data
 
-    return qc
+
+def ColorHeightArraysFromProbabilities(probabilityArrays, width, height, log=False):
+    # all channels are decoded in a single call, one flat buffer for each
+    return [probs2height(probabilities, (width, height), log, heightmap=True).data for probabilities in probabilityArrays]
+
+
+def CombinedHeightArrayFromProbabilities(probabilities, numberOfQubits, width, height, log=False, max_h=0):
+    marginals = probs2marginals(numberOfQubits, probabilities)
+    heightMap = probs2height(marginals[0], (width, height), log, max_h, heightmap=True)
+    return heightMap.data
     
 def HeightFromProbabilities(stringList, probabilityList, length, dimension, log=False):
     probabilityDict =	{
@@ -58,9 +90,20 @@ def CombinedHeightFromProbabilities(stringList, probabilityList, length, numberO
     heights = probs2height(marginals[0], eval(dimension), log, max_h)
     return heights
 
+
+def copy_circuit(circuit):
+    if simple_python:
+        qc = QuantumCircuit(circuit.num_qubits, circuit.num_clbits)
+        qc.data = list(circuit.data)
+        qc.name = circuit.name
+        return qc
+    return circuit.copy()
+
     
-def partial_x(circuit,fraction):
-    for j in range(circuit.num_qubits):
+def partial_x(circuit,fraction,axis=None,qubits=None):
+    if qubits is None:
+        qubits = circuit_blur_qubits(circuit, axis)
+    for j in qubits:
         circuit.rx(pi*fraction,j)
     #return circuit;
     
@@ -68,16 +111,55 @@ def partial_x(circuit,fraction):
 class QuantumBlurHelper():
     def __init__(self, name=""):
         self.name = name
+        self.heightMap = None
         
     def SetHeights(self, height, x, y, log=False):
-        self.qc = CircuitFromHeight(height, x, y, log)        
+        heightMap = HeightMapFromHeight(height, x, y)
+        # the encoded state (and any blurs of it) are kept if nothing has changed
+        unchanged = self.heightMap is not None and self.log==log \
+            and self.heightMap.size==heightMap.size and self.heightMap.data==heightMap.data
+        self.heightMap = heightMap
+        self.log = log
+        self.session = None
+        if not unchanged:
+            self.baseCircuit = height2circuit(self.heightMap, log)
+            self.blurs = {}
+            self.blurredHeights = None
+        self.ApplyPartialX(0)
         
     def GetCircuit(self):
         return self.qc
 
-    def ApplyPartialX(self, fraction):
-        #self.qc = partial_x(self.qc, fraction)
-        partial_x(self.qc, fraction) 
+    def ApplyPartialX(self, fraction, axis=None):
+        # the rotations replace those of any previous call, rather than adding to them
+        self.fraction = fraction
+        self.axis = axis
+        self.qc = copy_circuit(self.baseCircuit)
+        if fraction!=0:
+            partial_x(self.qc, fraction, axis)
+
+    def GetHeights(self):
+        # the blur for each axis is prepared only once, and the last result is kept
+        key = (self.fraction, self.axis)
+        if self.blurredHeights is None or self.blurredHeights[0]!=key:
+            if self.axis not in self.blurs:
+                self.blurs[self.axis] = PartialXBlur(self.baseCircuit, axis=self.axis)
+            self.blurredHeights = (key, self.blurs[self.axis].height(self.fraction, self.log))
+        return self.blurredHeights[1]
+
+    # Blur sessions, for when only a few heights change between frames
+
+    def StartBlur(self, fraction, axis=None):
+        self.session = BlurSession(self.heightMap, fraction, self.log, axis=axis)
+
+    def EditHeights(self, xList, yList, heightList, length):
+        changes = {}
+        for i in range(length):
+            changes[xList[i],yList[i]] = heightList[i]
+        self.session.update(changes)
+
+    def GetBlurredHeights(self):
+        return self.session.height()
 
 
 class TeleportationHelper():